@@ -8,24 +8,23 @@
 # In[2]:
 
 
-get_ipython().run_line_magic('matplotlib', 'inline')
-get_ipython().run_line_magic('config', "InlineBackend.figure_format='svg'")
+try:
+    get_ipython().run_line_magic('matplotlib', 'inline')
+    get_ipython().run_line_magic('config', "InlineBackend.figure_format='svg'")
+except NameError: # Not running in IPython (python -m okcupid.report renders the figures headless)
+    import matplotlib
+    matplotlib.use("Agg")
 from IPython.display import display,HTML
 import pandas as pd
 import seaborn as sns
-from scipy.stats import kendalltau
 import numpy as np
-import math
 import matplotlib.pyplot as plt
 
 from prettypandas import PrettyPandas
 sns.set(style="ticks")
 sns.set_context(context="notebook",font_scale=1)
 
-import string
-import tqdm # a cool progress bar
-import re
-import json
+from okcupid import aggregate, cache, correlation, cube, dal, figures, growth, index, indexes, ingest, layout, prevalence, runner, search, sketch, snapshot, text, timing
 
 import pymongo
 from pymongo import MongoClient
@@ -40,7 +39,17 @@ from pymongo import MongoClient
 # In[3]:
 
 
-d=pd.read_csv("/home/master/UseCase_OKCupid/profiles.csv")
+# Time, CPU, peak memory and MongoDB commands of the main stages of this run (see okcupid.timing)
+profiler=timing.Profiler()
+
+PROFILES_CSV="/home/master/UseCase_OKCupid/profiles.csv"
+# The CSV is converted once into a memory-mapped columnar snapshot (see okcupid.snapshot); columns are then
+# loaded lazily, and we leave the long essay columns out for now
+SNAPSHOT_DIR="/home/master/UseCase_OKCupid/profiles.snapshot"
+with profiler.stage("load snapshot") as stage:
+    snap=snapshot.open_snapshot(PROFILES_CSV,SNAPSHOT_DIR)
+    d=snap.to_frame([c for c in snap.columns if "essay" not in c])
+    stage["rows"]=len(d)
 print("The dataset contains {} records".format(len(d)))
 
 
@@ -49,21 +58,44 @@ print("The dataset contains {} records".format(len(d)))
 
 ########################################################### Database Connection and Load ############################
 print('Mongo version', pymongo.__version__)
-client = MongoClient('localhost', 27017)
+client = MongoClient('localhost', 27017, event_listeners=[profiler.mongo_listener()])
 db = client.test
 collection = db.okcupid
 
+
+# In[5]:
+
+
 #Import data into the database
-collection.drop()
+# Only new or changed profiles are inserted and removed ones deleted; an unchanged CSV is not read at all, as long
+# as the collection still holds all its rows (the two outliers deleted below are inserted again on the next run).
+# (ingest.load streams a full import, for an empty collection.)
+# Each essay is stored with the array of its distinct words, to search essays through an index.
+with profiler.stage("mongo sync"):
+    ingest.sync(collection,PROFILES_CSV,batch_size=2000,transform=search.add_tokens)
+    search.ensure_token_indexes(collection)
 
+# Create the indexes used by our filters and sorts, and check that no query still scans the whole collection
+with profiler.stage("mongo indexes"):
+    print("Created indexes:", indexes.ensure_indexes(collection))
+pd.DataFrame(indexes.explain_report(collection))
 
-# In[5]:
 
+# The same profiles can be stored in a hot/cold layout: slim profile documents, and their essays (with the token
+# arrays) in a separate zstd-compressed collection under the same _id. Demographic queries then never read essay
+# pages, and dal.ProfileStore(profiles_hot,essays=essays_cold) fetches the essays only when asked (see okcupid.layout).
+# This analysis reads the okcupid collection, so the second copy is only built on request, to compare the layouts.
 
-# Transform dataframe to Json and store in MongoDB
-records = json.loads(d.to_json(orient='records'))
-collection.delete_many({})
-collection.insert_many(records)
+# In[ ]:
+
+
+HOT_COLD_LAYOUT=False
+if HOT_COLD_LAYOUT:
+    profiles_hot = db.okcupid_profiles
+    essays_cold = layout.essay_collection(db)
+    ingest.sync(profiles_hot,PROFILES_CSV,batch_size=2000,transform=search.add_tokens,essays=essays_cold)
+    search.ensure_token_indexes(essays_cold)
+    display(layout.storage_report(db,["okcupid","okcupid_profiles","okcupid_essays"]))
 
 
 # In[6]:
@@ -78,24 +110,15 @@ for doc in cursor:
 # In[7]:
 
 
-pipeline = [
-        {"$match": {"sex":"m"}},
-]
-
-aggResult = collection.aggregate(pipeline)
-male = pd.DataFrame(list(aggResult))
+# Only fetch the few documents we display
+male = pd.DataFrame(list(collection.find({"sex":"m"}).limit(5)))
 male.head()
 
 
 # In[8]:
 
 
-pipeline = [
-        {"$match": {"sex":"f"}},
-]
-
-aggResult = collection.aggregate(pipeline)
-female = pd.DataFrame(list(aggResult))
+female = pd.DataFrame(list(collection.find({"sex":"f"}).limit(2)))
 female.head(2)
 
 
@@ -104,9 +127,12 @@ female.head(2)
 # In[9]:
 
 
+# Count users per sex inside MongoDB
+with profiler.stage("count by sex"):
+    nsex=aggregate.count_by(collection,"sex")
 print("{} males ({:.1%}), {} females ({:.1%})".format(
-    len(male),len(male)/len(d),
-    len(female),len(female)/len(d)))
+    nsex["m"],nsex["m"]/len(d),
+    nsex["f"],nsex["f"]/len(d)))
 
 
 # In[10]:
@@ -142,7 +168,8 @@ collection.find({"age":{ "$gt": 80 }}).count()
 
 ##Let's assume the 110-year-old lady and the athletic 109-year-old gentleman (who's working on a masters program) are outliers: we get rid of them so the following plots look better. They didn't say much else about themselves, anyway.
 ##We then remove them
-collection.delete_many({"age":{ "$gt": 80 }})
+with profiler.stage("remove outliers"):
+    collection.delete_many({"age":{ "$gt": 80 }})
 collection.find({"age":{ "$gt": 80 }}).count()
 print("The dataset now contains {} records".format(collection.find({"age":{ "$lt": 80 }}).count()))
 
@@ -166,31 +193,51 @@ PrettyPandas(d[d["age"]>80])
 # In[16]:
 
 
-# Isolate male's dataset
-aggResult = collection.aggregate([{"$match": {"sex":"m"}}])
-male = pd.DataFrame(list(aggResult))
+# Isolate male's dataset (only the columns used below, with compact dtypes)
+store = dal.ProfileStore(collection)
+with profiler.stage("load male heights") as stage:
+    male = store.load(["age","height"],{"sex":"m"})
+    stage["rows"]=len(male)
 
 
 # In[17]:
 
 
 # Isolate female's dataset 
-aggResult = collection.aggregate([{"$match": {"sex":"f"}}])
-female = pd.DataFrame(list(aggResult))
+with profiler.stage("load female heights") as stage:
+    female = store.load(["age","height"],{"sex":"f"})
+    stage["rows"]=len(female)
 
 
 # In[18]:
 
 
+with profiler.stage("count by sex"):
+    nsex=aggregate.count_by(collection,"sex")
 print("{} males ({:.1%}), {} females ({:.1%})".format(
-    len(male),len(male)/len(d),
-    len(female),len(female)/len(d)))
+    nsex["m"],nsex["m"]/nsex.sum(),
+    nsex["f"],nsex["f"]/nsex.sum()))
 
 
 # In[19]:
 
 
-d=pd.DataFrame(list(collection.find()))
+# Essays are not fetched here, they are loaded separately when we analyze them
+with profiler.stage("load profiles") as stage:
+    d=store.profiles()
+    stage["rows"]=len(d)
+
+
+# The summary plots below are all drawn from one pre-aggregated cube: number of users, sum and sum of squares of
+# height, and a height histogram for every (sex, age, body_type). Roll-ups to fewer dimensions are sums of cells,
+# and new profiles are added with profile_cube.update(new_profiles) (see okcupid.cube)
+
+# In[ ]:
+
+
+with profiler.stage("profile cube",rows=len(d)):
+    profile_cube=cube.Cube.build(d,["sex","age","body_type"],{"height":range(36,96)})
+    by_age=profile_cube.rollup(["sex","age"])
 
 
 # In[20]:
@@ -206,21 +253,10 @@ print("There are {} users older than 80".format((d["age"]>80).sum()))
 # In[21]:
 
 
-fig,(ax1,ax2) = plt.subplots(ncols=2,figsize=(10,3),sharey=True,sharex=True)
-sns.distplot(male["age"], ax=ax1,
-             bins=range(d["age"].min(),d["age"].max()),
-             kde=False,
-             color="g")
-ax1.set_title("Age distribution for males")
-sns.distplot(female["age"], ax=ax2,
-             bins=range(d["age"].min(),d["age"].max()),
-             kde=False,
-             color="b")
-ax2.set_title("Age distribution for females")
-ax1.set_ylabel("Number of users in age group")
-for ax in (ax1,ax2):
-    sns.despine(ax=ax)
-fig.tight_layout()
+# Number of users per sex and age, from the cube
+ages=by_age.count()
+with profiler.stage("figure age histograms"):
+    figures.age_histograms(ages);
 
 
 # Note that both distributions are right-skewed. Then, as is often (but not always!) the case, the mean is larger than the median.
@@ -228,8 +264,12 @@ fig.tight_layout()
 # In[22]:
 
 
-print("Mean and median age for males:   {:.2f}, {:.2f}".format(male["age"].mean(),male["age"].median()))
-print("Mean and median age for females: {:.2f}, {:.2f}".format(female["age"].mean(),female["age"].median()))
+with profiler.stage("age mean and median"):
+    mean_age=aggregate.group_mean(collection,"age","sex")
+    print("Mean and median age for males:   {:.2f}, {:.2f}".format(
+        mean_age["m"],aggregate.median(collection,"age",{"sex":"m"})))
+    print("Mean and median age for females: {:.2f}, {:.2f}".format(
+        mean_age["f"],aggregate.median(collection,"age",{"sex":"f"})))
 
 
 # Females seem to be on average slightly older than males. Let's compare the age distributions in a single plot
@@ -239,40 +279,9 @@ print("Mean and median age for females: {:.2f}, {:.2f}".format(female["age"].mea
 
 #########################################################################################################
 
-fig,(ax1,ax2) = plt.subplots(nrows=2,figsize=(10,6),sharex=True)
-# Plot the age distributions of males and females on the same axis
-sns.distplot(male["age"], ax=ax1,
-             bins=range(d["age"].min(),d["age"].max()),
-             kde=False,
-             color="g",
-             label="males")
-sns.distplot(female["age"], ax=ax1,
-             bins=range(d["age"].min(),d["age"].max()),
-             kde=False,
-             color="b",
-             label="females")
-ax1.set_ylabel("Number of users in age group")
-ax1.set_xlabel("")
-ax1.legend()
-
-# Compute the fraction of males for every age value
-fraction_of_males=(male["age"].value_counts()/d["age"].value_counts())
-# Ignore values computed from age groups in which we have less than 100 total users (else estimates are too unstable)
-fraction_of_males[d["age"].value_counts()<100]=None
-barlist=ax2.bar(x=fraction_of_males.index,
-        height=fraction_of_males*100-50,
-        bottom=50, width=1, color="gray")
-for bar,frac in zip(barlist,fraction_of_males):
-    bar.set_color("g" if frac>.5 else "b")
-    bar.set_alpha(0.4)
-ax2.set_xlim([18,70])
-ax2.set_xlabel("age")
-ax2.set_ylabel("percentage of males in age group")
-ax2.axhline(y=50,color="k")
-
-for ax in (ax1,ax2):
-    sns.despine(ax=ax)
-fig.tight_layout()
+# Plot the age distributions of males and females on the same axis, and the percentage of males in each age group
+with profiler.stage("figure age comparison"):
+    figures.age_comparison(ages);
 
 
 # Over-60 users are not many, but in this group there are significantly more females than males. This may be explained by the fact that, in this age group, there are more females than males in the general population.
@@ -282,8 +291,13 @@ fig.tight_layout()
 
 ##########################################################################################################
 
-# Age distributions of age in jointplots
-sns.jointplot(male['age'], female['age'], kind="hex", stat_func=kendalltau, color="#4CB391")
+# Correlations between age, height and income, for all users and for each sex (income is -1 when not reported)
+with profiler.stage("correlations",rows=len(d)):
+    numeric=d[["sex","age","height","income"]].replace({"income":{-1:np.nan}})
+    correlations=correlation.pairs(numeric,["age","height","income"])
+    correlations_by_sex=correlation.pairs(numeric,["age","height","income"],by=["sex"])
+display(PrettyPandas(correlations,precision=3))
+display(PrettyPandas(correlations_by_sex,precision=3))
 
 
 # #### Study height distribution and compare with official data from the US Centers of Disease Control and Prevention ([CDC](https://www.cdc.gov/))
@@ -292,32 +306,9 @@ sns.jointplot(male['age'], female['age'], kind="hex", stat_func=kendalltau, colo
 # In[26]:
 
 
-fig,(ax,ax2) = plt.subplots(nrows=2,sharex=True,figsize=(6,6),gridspec_kw={'height_ratios':[2,1]})
-# Plot histograms of height
-bins=range(55,80)
-sns.distplot(male["height"].dropna(), ax=ax,
-             bins=bins,
-             kde=False,
-             color="g",
-             label="males")
-sns.distplot(female["height"].dropna(), ax=ax,
-             bins=bins,
-             kde=False,
-             color="b",
-             label="females")
-ax.legend(loc="upper left")
-ax.set_xlabel("")
-ax.set_ylabel("Number of users with given height")
-ax.set_title("height distribution of male and female users");
-
-# Make aligned boxplots
-sns.boxplot(data=d,y="sex",x="height",orient="h",ax=ax2,palette={"m":"g","f":"b"})
-plt.setp(ax2.artists, alpha=.5)
-ax2.set_xlim([min(bins),max(bins)])
-ax2.set_xlabel("Self-reported height [inches]")
-
-sns.despine(ax=ax)
-fig.tight_layout()
+# Plot histograms of height and aligned boxplots
+with profiler.stage("figure height distribution"):
+    figures.height_distribution(profile_cube.rollup(["sex"]).histogram("height"));
 
 
 # Males are (as suspected) taller than females, and the two distributions make sense.
@@ -326,44 +317,23 @@ fig.tight_layout()
 # 
 # The CDC publishes growth charts, which contain height data for the general US population. The dataset reports statistics (3rd, 5th, 10th, 25th, 50th, 75th, 90th, 95th, 97th percentiles) for stature for different ages from 2 to 20 years. This (and more) data is plotted by the CDC in these beautiful charts.
 
-# #### Generate a new collection to store CDC data #################
-# The idea is to cross databases attributes to compare CDC versus OKCupid
+# #### Load the CDC growth charts
+# The CDC table is downloaded once and kept in a local cache; it is loaded into per-sex arrays so that
+# any user can be compared with the growth charts (see okcupid.growth.GrowthChart)
 # 
 
 # In[27]:
 
 
-col_cdc = db.cdcdb
-
-#Import data into the database
-col_cdc.drop()
-
-
-# In[28]:
-
-
-records = json.loads(pd.read_csv("https://www.cdc.gov/growthcharts/data/zscore/statage.csv").to_json(orient='records'))
-col_cdc.delete_many({})
-col_cdc.insert_many(records)
-
-
-# In[29]:
-
-
-#Check if you can access the data from the MongoDB.
-cursor = col_cdc.find().limit(10)
-for doc in cursor:
-    print(doc)
+with profiler.stage("growth chart"):
+    chart=growth.GrowthChart.load("https://www.cdc.gov/growthcharts/data/zscore/statage.csv")
 
 
 # In[30]:
 
 
-# Transform data attribute "Sex" to accomodate to OKCupid format
-col_cdc.update_many({"Sex":1},{'$set':{"Sex":"m"}})
-col_cdc.update_many({"Sex":2},{'$set':{"Sex":"f"}})
-
-cdc = pd.DataFrame(list(col_cdc.find()))
+# The data was adjusted to fit our format: sex as "m"/"f", age in fractional years, percentiles in inches (ugh)
+cdc=chart.table
 cdc.head(5)
 
 
@@ -373,19 +343,11 @@ cdc.head(5)
 cdc.tail(5)
 
 
-# In[32]:
-
-
-# Adjust the data to fit our format
-cdc["Age"]=cdc["Agemos"]/12 # convert age in months to age in fractional years
-
-
 # In[33]:
 
 
-percentiles=[3,5,10,25,50,75,90,95,97]
-percentile_columns=["P"+str(p) for p in percentiles] # names of percentile columns
-cdc[percentile_columns]=cdc[percentile_columns]*0.393701 # convert percentile columns from centimeters to inches (ugh)
+percentiles=growth.PERCENTILES
+percentile_columns=growth.PERCENTILE_COLUMNS # names of percentile columns
 cdc20=cdc[cdc["Age"]==20].set_index("Sex") # Select the two rows corresponding to 20-year-olds (males and females)
 
 
@@ -411,29 +373,18 @@ fheights=female.loc[female["age"]==20,"height"] # heights of 20-year-old females
 
 
 # To smooth the computation of percentiles, jitter height data by adding
-# uniformly distributed noise in the range [-0.5,+0.5]
-mheightsj=mheights+np.random.uniform(low=-0.5,high=+0.5,size=(len(mheights),))
-fheightsj=fheights+np.random.uniform(low=-0.5,high=+0.5,size=(len(fheights),))
+# uniformly distributed noise in the range [-0.5,+0.5]; the percentiles are averaged over 1000 jitter draws,
+# and bootstrapped to get 95% confidence intervals (see growth.percentile_comparison)
+heights20={"m":mheights,"f":fheights}
 
 
 # In[38]:
 
 
-# For each of the available percentiles in CDC data, compute the corresponding percentile from our 20-year-old users
-stats=[]
-for percentile,percentile_column in zip(percentiles,percentile_columns):
-    stats.append({"sex":"m",
-                  "percentile":percentile,
-                  "CDC":cdc20.loc["m",percentile_column],
-                  "users":mheightsj.quantile(percentile/100)})
-    stats.append({"sex":"f",
-                  "percentile":percentile,
-                  "CDC":cdc20.loc["f",percentile_column],
-                  "users":fheightsj.quantile(percentile/100)})
-stats=pd.DataFrame(stats).set_index(["sex","percentile"]).sort_index()
-
-# For each percentile, compute the gap between users and CDC
-stats["gap"]=stats["users"]-stats["CDC"]
+# For each of the available percentiles in CDC data, compute the corresponding percentile from our 20-year-old users,
+# and the gap between users and CDC
+with profiler.stage("percentile comparison",rows=len(mheights)+len(fheights)):
+    stats=growth.percentile_comparison(heights20,cdc20,rng=0,n_boot=1000)
 
 print("Height percentiles (in inches) for 20-year-old males")
 display(PrettyPandas(stats.loc["m"],precision=4))
@@ -450,20 +401,29 @@ display(PrettyPandas(stats.loc["f"],precision=4))
 
 
 #PLOT the differences
+with profiler.stage("figure percentile comparison"):
+    figures.percentile_comparison(stats);
 
-fig,(ax1,ax2)=plt.subplots(ncols=2,sharex=True,figsize=(10,4))
-#stats.loc["m"][["users","CDC"]].plot.bar(ax=ax1,color=[[0.5,0.5,1],"k"],alpha=1,width=0.8,rot=0)
-stats.loc["m"][["users","CDC"]].plot.bar(ax=ax1,color=["b","grey"],alpha=1,width=0.8,rot=0)
-stats.loc["f"][["users","CDC"]].plot.bar(ax=ax2,color=["g","lightgrey"],alpha=1,width=0.8,rot=0)
-ax1.set_ylim([64,77])
-ax2.set_ylim([58,71])
-ax1.set_ylabel("Height [inches]")
-ax2.set_ylabel("Height [inches]")
-ax1.set_title("Height percentiles in 20y-old male users vs CDC data")
-ax2.set_title("Height percentiles in 20y-old female users vs CDC data")
-for ax in (ax1,ax2):
-    sns.despine(ax=ax)
-fig.tight_layout()
+
+# The same comparison for every age of the users (ages over 20 are compared with 20-year-olds)
+
+# In[ ]:
+
+
+with profiler.stage("percentile comparison by age",rows=len(d)):
+    stats_by_age=growth.percentile_comparison_by_age(d[["sex","age","height"]],cdc,rng=0)
+stats_by_age.xs(50,level="percentile")[["users","CDC","gap","gap_low","gap_high"]].unstack("sex").head(10)
+
+
+# Using the LMS parameters of the CDC table, we can place every user (not only the 20-year-olds) on the growth charts
+# of their sex and age. Ages over 20 are compared with 20-year-olds.
+
+# In[ ]:
+
+
+with profiler.stage("height percentiles",rows=len(d)):
+    d["height_percentile"]=chart.percentile(d["sex"],d["age"],d["height"])
+d.groupby("sex",observed=True)["height_percentile"].describe()
 
 
 # In[41]:
@@ -478,24 +438,10 @@ d["height"].isnull().sum()
 # In[42]:
 
 
-# Investigate heights vs sex vs age
-g=d.groupby(["sex","age"])["height"].mean()
-fig,(ax1,ax2)=plt.subplots(ncols=2,sharex=True,figsize=(10,3))
-ax1.plot(g["m"],color="g")
-ax1.set_xlim(18,27)
-ax1.set_ylim(69.5,71)
-ax1.set(title="Average height vs age for males",
-        ylabel="height",
-        xlabel="age")
-ax2.plot(g["f"],color="b")
-ax2.set_xlim(18,27)
-ax2.set_ylim(64,65.5)
-ax2.set(title="Average height vs age for females",
-        ylabel="height",
-        xlabel="age");
-for ax in (ax1,ax2):
-    sns.despine(ax=ax)
-fig.tight_layout()
+# Investigate heights vs sex vs age (the means come from the sums of the cube)
+g=by_age.mean("height")
+with profiler.stage("figure height vs age"):
+    figures.height_vs_age(g);
 
 
 # In[43]:
@@ -503,8 +449,8 @@ fig.tight_layout()
 
 ### We can also overlay CDC growth charts to the above plots, with minimal data wrangling.
 
-cdc_m=cdc[cdc["Sex"]=="m"].groupby(np.floor(cdc["Age"]))[percentile_columns].mean()
-cdc_f=cdc[cdc["Sex"]=="f"].groupby(np.floor(cdc["Age"]))[percentile_columns].mean()
+cdc_m=growth.by_year(cdc,"m")
+cdc_f=growth.by_year(cdc,"f")
 
 # Result for males
 display(PrettyPandas(cdc_m,precision=4))
@@ -521,61 +467,11 @@ display(PrettyPandas(cdc_f,precision=4))
 
 
 ############################################################# Compare CDC and OKCupid Percentiles #######################################################
-# Compute average height per sex and age
-g=d.groupby(["sex","age"])["height"].mean()
-
-fig,(ax1,ax2)=plt.subplots(ncols=2,sharex=True,figsize=(10,5))
-ax1.plot(g["m"],color="g",label="Mean of male OkCupid users")
-ax1.plot(cdc_m["P75"],color="k",linestyle='dotted',label="75th percentile of male US Population")
-ax1.plot(cdc_m["P50"],color="k",label="Median of male US Population")
-ax1.plot(cdc_m["P25"],color="k",linestyle='dotted',label="25th percentile of male US Population")
-ax1.fill_between(cdc_m.index,cdc_m["P25"],cdc_m["P75"],color="k",alpha=0.1,linewidth=0)
-
-
-
-#ax1.legend(loc="lower right")
-# Use direct labeling instead of a legend
-x=cdc_m["P50"].index[-1]
-ax1.text(x, g["m"].loc[:26].max(), " Mean of male OkCupid users", color="g",
-         verticalalignment="bottom",fontsize="small")
-ax1.text(x, cdc_m["P75"].iloc[-1]," 75th percentile of male US Population",
-         verticalalignment="center",fontsize="small")
-ax1.text(x, cdc_m["P50"].iloc[-1]," Median of male US Population",
-         verticalalignment="center",fontsize="small")
-ax1.text(x, cdc_m["P25"].iloc[-1]," 25th percentile of male US Population",
-         verticalalignment="center",fontsize="small")
-
-ax1.set_xlim(16,27)
-ax1.set_ylim(67,72)
-ax1.set(title="height vs age for males",
-        ylabel="height [inches]",
-        xlabel="age (rounded down for CDC data) [years]");
-ax2.plot(g["f"],color="b",label="Mean of female OkCupid users")
-ax2.plot(cdc_f["P75"],color="k",linestyle='dotted',label="75th percentile of female US Population")
-ax2.plot(cdc_f["P50"],color="k",label="Median of female US Population")
-ax2.plot(cdc_f["P25"],color="k",linestyle='dotted',label="25th percentile of female US Population")
-ax2.fill_between(cdc_f.index,cdc_f["P25"],cdc_f["P75"],color="k",alpha=0.1,linewidth=0)
-
-#ax2.legend(loc="lower right")
-# Use direct labeling instead of a legend
-x=cdc_f["P50"].index[-1]
-ax2.text(x, g["f"].loc[:26].max(), " Mean of female OkCupid users", color="b",
-         verticalalignment="bottom",fontsize="small")
-ax2.text(x, cdc_f["P75"].iloc[-1]," 75th percentile of female US Population",
-         verticalalignment="center",fontsize="small")
-ax2.text(x, cdc_f["P50"].iloc[-1]," Median of female US Population",
-         verticalalignment="center",fontsize="small")
-ax2.text(x, cdc_f["P25"].iloc[-1]," 25th percentile of female US Population",
-         verticalalignment="center",fontsize="small")
-
-ax2.set_xlim(16,27)
-ax2.set_ylim(62,67)
-ax2.set(title="height vs age for females",
-        ylabel="height [inches]",
-        xlabel="age (rounded down for CDC data) [years]");
-for ax in (ax1,ax2):
-    sns.despine(ax=ax)
-fig.tight_layout()
+# Average height per sex and age (g, from the cube)
+
+# Overlay the CDC percentiles, using direct labeling instead of a legend
+with profiler.stage("figure height vs CDC"):
+    figures.height_vs_cdc(g,cdc_m,cdc_f);
 
 
 # #### How do users self-report their body type?
@@ -584,12 +480,8 @@ fig.tight_layout()
 # In[46]:
 
 
-fig,ax=plt.subplots(figsize=(6,5))
-sns.countplot(y="body_type",hue="sex",
-              order=d["body_type"].value_counts().sort_values(ascending=False).index,
-              data=d,palette={"m":"g","f":"b"},alpha=0.5,ax=ax);
-ax.set_title("Number of female and male users self-reporting each body type")
-sns.despine(ax=ax)
+with profiler.stage("figure body type counts"):
+    figures.body_type_counts(profile_cube.rollup(["sex","body_type"]).count());
 
 
 # In the plot above, males and females are two sub-groups of the population, whereas body_type is a categorical attribute. It is interesting to compare how users in each of the two sub-groups (i.e. males and females) are likely to use each of the available categorical values; this is normally done through contingency tables.
@@ -597,77 +489,17 @@ sns.despine(ax=ax)
 # In[47]:
 
 
-# Define visualization function
+# Define visualization function (every call is timed as a stage)
+@profiler.timed("compare prevalence")
 def compare_prevalence(series,g1,g2,g1name,g2name,g1color,g2color,ax):
     
-    # for each categorical value represented in series, number of users in group g1 which have this value
-    g1n=series.loc[g1].value_counts()
-    # for each categorical value represented in series, number of users in group g2 which have this value
-    g2n=series.loc[g2].value_counts()
-    
-    # join the two series in a single dataframe, filling 0 where indices don't match
-    # (e.g. if a value represented in g1 did never appear in g2)
-    df=pd.concat({"g1n":g1n,"g2n":g2n},axis=1).fillna(0)
-    # df has one row for every distinct value of series in the union of g1 and g2
-    
-    # normalize the data
-    df["g1f"]=df["g1n"]/(df["g1n"].sum()) # fraction of g1 users with each categorical value
-    df["g2f"]=df["g2n"]/(df["g2n"].sum()) # fraction of g2 users with each categorical value
-    
-    assert(math.isclose(df["g1f"].sum(),1)) 
-    assert(math.isclose(df["g2f"].sum(),1))
-    
-    # for each row of df, we now compute how frequent the value was in g1 compared to the frequency it had in g2.
-    df["frac12"]=df["g1f"]/(df["g1f"]+df["g2f"])
-    # we expect df["frac12"] to be 0.5 for values that were equally frequent in g1 and g2 (note that this does not depend on the size of g1 and g2)
-    # we expect df["frac12"] to be 0 for values that were only seen in g2 and never seen in g1
-    # we expect df["frac12"] to be 1 for values that were only seen in g1 and never seen in g2
-    
-    df=df[(df["g1n"]+df["g2n"])>=50] # exclude values which are too rare
-    df=df.sort_values("frac12")
-    
-    # Draw the left bars
-    ax.barh(y=range(len(df)),
-                width=df["frac12"],
-                left=0,
-                height=1,
-                align="center",
-                color=g1color,alpha=1)
-    # Draw the right bars
-    ax.barh(y=range(len(df)),
-                width=df["frac12"]-1,
-                left=1,
-                height=1,
-                align="center",
-                color=g2color,alpha=1)
+    # Count the values of series in the two groups and compute their relative prevalence
+    # (see okcupid.prevalence for the definition of g1f, g2f and frac12)
+    counts=prevalence.crosstab(series.to_frame(),[series.name],{"g1":g1,"g2":g2})
+    df=prevalence.compare(counts,"g1","g2").loc[series.name]
     
-    # Draw a faint vertical line for x=0.5
-    ax.axvline(x=0.5,color="k",alpha=0.1,linewidth=5)
-    ax.set(xlim=[0,1],
-           ylim=[-1,len(df)-0.5],
-           yticks=range(len(df)),
-           yticklabels=df.index,
-           xlabel="fraction of users",
-           ylabel=series.name)
-    
-    ax.set_title("Relative prevalence of {} ($n={}$) vs {} ($n={}$)\nfor each value of {}".format(
-                g1name,g1.sum(),g2name,g2.sum(),series.name),
-                loc="left",fontdict={"fontsize":"medium"})
-    ax.text(0.02,len(df)-1,g1name,verticalalignment="center",horizontalalignment="left",size="smaller",color="w")
-    ax.text(0.98,0,g2name,verticalalignment="center",horizontalalignment="right",size="smaller",color="w")
-
-    def color_for_frac(f):
-        # Blend g1color and g2color according to f (convex linear combination):
-        # 0 returns g1color, 1 returns g2color)
-        ret=np.array(g1color)*f+np.array(g2color)*(1-f)
-        if(np.linalg.norm(ret)>1):          # If the resulting rgb color is too bright for text,
-            ret=(ret/np.linalg.norm(ret))*1 # rescale its brightness to dark (but keep hue)
-        return ret
-        
-    for i,tl in enumerate(plt.gca().get_yticklabels()):
-        tl.set_color(color_for_frac(df["frac12"].iloc[i]))
-        
-    sns.despine(ax=ax,left=True)
+    # Draw the bars of the two groups for each value (see okcupid.figures)
+    figures.compare_prevalence(df,series.name,g1name,g2name,g1.sum(),g2.sum(),g1color,g2color,ax)
 
 # Apply visualization function 
 fig,ax = plt.subplots(figsize=(10,3))
@@ -680,6 +512,19 @@ compare_prevalence(
 fig.tight_layout()
 
 
+# The same computation runs for every categorical attribute and several group splits at once, without plotting.
+
+# In[ ]:
+
+
+groups={"male":d["sex"]=="m", "female":d["sex"]=="f",
+        "under 30":d["age"]<30, "30 and over":d["age"]>=30}
+with profiler.stage("prevalence screen",rows=len(d)):
+    screen=prevalence.screen(d,["body_type","diet","drinks","drugs","education","job","religion","smokes"],
+                             groups,[("male","female"),("under 30","30 and over")])
+screen.sort_values("frac12").groupby(level=["pair","attribute"]).head(1)
+
+
 # ### Analyzing essays
 # ##### The data contains essays written by the users on the following topics:
 # - essay0: My self summary
@@ -697,20 +542,25 @@ fig.tight_layout()
 
 
 # In the following, we concatenate all essays to a single string and ignore the different themes.
-d["essays"]=""
-for f in ["essay"+str(i) for i in range(10)]:
-    d.loc[d[f].isnull(),f]=""
-    d["essays"]=d["essays"]+" "+d[f]
+# The whole essay pipeline below (concatenation, word counts, term matrix) is cached on disk, keyed by a hash
+# of the essays and of its parameters: re-runs over the same data load the results instead of recomputing them.
+with profiler.stage("essay features") as stage:
+    essays=store.essays()
+    features=cache.essay_features(essays,cache.FeatureCache(".okcupid_cache"),
+                                  n_words=10000,      # Let's consider the most common 10k words
+                                  min_length=4,       # with at least 4 characters
+                                  drop=["href"])      # These frequent words were part of the html and we should ignore them
+    stage["rows"]=len(essays)
+essay_text=features.essays # All essays in one contiguous string, with the offset of each user's essays
 
 
 # In[49]:
 
 
 # Let's index and count all unique words in all essays.
-from collections import Counter
-wordcounts=Counter()
-for e in d["essays"].str.split():
-    wordcounts.update([w.strip(string.whitespace+string.punctuation) for w in e])
+# Chunks of essays are counted in parallel on all cores, and the partial counts merged.
+# text.count_words(text.read_essays(PROFILES_CSV)) gives the same counts streaming from the CSV.
+wordcounts=features.wordcounts
 
 
 # In[50]:
@@ -725,32 +575,20 @@ for w,c in wordcounts.most_common(100):
 
 # Among tha 10k most common words, we filter those with at least 4 characters. We build a dataframe that contains a binary column 
 # for each of these and a row for each user. The value will be True where if the user's essay contains the word, False otherwise.
-
-#import tqdm # a cool progress bar
-
-# Let's consider the most common 10k words
-#words=[w for w,c in wordcounts.most_common(10000) if len(w)>=4 and w.isalpha()]
-
-words=[w for w,c in wordcounts.most_common(100) if len(w)>=4 and w.isalpha()]
+words=features.words
 
 
 # In[53]:
 
 
-d_contains=pd.DataFrame(index=d.index)
-# This operation takes a lot of time
-for w in tqdm.tqdm(words):
-    d_contains[w]=d["essays"].str.contains("\\b"+w+"\\b")
+# Every essay was tokenized once to fill a sparse (user x word) matrix, instead of one regex scan per word
+with profiler.stage("d_contains",rows=len(d)):
+    d_contains=text.contains_frame(features.matrix,words,index=d.index)
 
 
 # In[54]:
 
 
-# These frequent words were part of the html and we should ignore them
-d_contains=d_contains.drop("href",axis=1)
-#d_contains=d_contains.drop("ilink",axis=1)
-d_contains.to_pickle("d_contains.pickle") # Save a cache
-
 print("The dataset contains {} rows (users) and {} columns (words)".format(
         len(d_contains.index),len(d_contains.columns)))
 
@@ -765,27 +603,72 @@ print("The dataset contains {} rows (users) and {} columns (words)".format(
 #We only display 100 users (i.e. less than one hundreth of all users in the dataset), and 100 words 
 #(i.e. about 1/80th of all the frequent words we found)
 
-fig,(ax1,ax2)=plt.subplots(nrows=2,sharex=True,figsize=(10,15))
-sns.heatmap(d_contains.iloc[0:100,0:49].transpose(),
-            ax=ax1,cbar=None)
-sns.heatmap(d_contains.iloc[0:100,-49:-1].transpose(),
-            ax=ax2,cbar=None)
-ax1.set_title("Which of the first 100 users (columns) use which of the 50 most frequent words (rows)")
-ax2.set_title("Which of the first 100 users (columns) use which of the 50 least frequent words (rows) among the "+str(d_contains.shape[1])+" most frequent ones")
-for ax in (ax1,ax2):
-    ax.set_xticks([])
-    ax.set_xlabel("Users")
-    ax.set_ylabel("User's essays contain word")
-fig.tight_layout()
+with profiler.stage("figure essay heatmap"):
+    figures.essay_heatmap(d_contains.iloc[0:100,0:49].sparse.to_dense(),
+                          d_contains.iloc[0:100,-49:-1].sparse.to_dense(),
+                          d_contains.shape[1]);
+
+
+# The whole (users x words) matrix can be shown at once: it is binned into a grid of 500 x 1000 pixels, straight from
+# the sparse matrix, and drawn as a single image. Reordering users and words by similarity shows the structure.
+
+# In[ ]:
+
+
+with profiler.stage("figure essay raster",rows=features.matrix.shape[0]):
+    density=text.bin_matrix(features.matrix,shape=(500,1000))
+    figures.essay_raster(density,*features.matrix.shape);
+
+    with profiler.stage("seriation"):
+        user_order,word_order=text.seriation(features.matrix)
+    density=text.bin_matrix(features.matrix,shape=(500,1000),row_order=user_order,col_order=word_order)
+    figures.essay_raster(density,*features.matrix.shape,reordered=True);
+
+
+# Which words are over-represented in the essays of a group? The term matrix gives the number of users of each group
+# using each of the 10k words with one sparse product, and their relative prevalence (frac12, as for categorical
+# attributes above), log odds ratio and significance.
+
+# In[ ]:
+
+
+# Users who didn't report their education are in neither education group
+essay_groups={"male":d["sex"]=="m", "female":d["sex"]=="f",
+              "college graduates":d["education"]=="graduated from college/university",
+              "others":d["education"].notna()&(d["education"]!="graduated from college/university"),
+              "english (fluently)":d["speaks"].str.contains("english (fluently)",regex=False,na=False),
+              "spanish":d["speaks"].str.contains("spanish",regex=False,na=False)}
+with profiler.stage("word contrast",rows=features.matrix.shape[0]):
+    word_contrast=prevalence.word_screen(features.matrix,words,essay_groups,
+                                         [("male","female"),("college graduates","others"),("english (fluently)","spanish")])
+word_contrast=word_contrast[word_contrast["pvalue"]<1e-6]
+pd.concat([word_contrast.groupby(level="pair").head(10),word_contrast.groupby(level="pair").tail(10)]).sort_index()
 
 
 # In[57]:
 
 
-print(d["essays"].str.contains("\\bbinding of isaac\\b").sum())
-print(d["essays"].str.contains("\\bisaac asimov\\b").sum())
-print(d["essays"].str.contains("\\basimov\\b").sum())
-d["essays"].str.extract("(\\bisaac [a-z]*\\b)").dropna().value_counts()
+# Index the essays once (term -> positions), then every probe is an intersection of postings.
+# The index is saved with a digest of the essays, and loaded instead of rebuilt while they don't change.
+with profiler.stage("essay index",rows=len(essay_text)):
+    essay_index=index.InvertedIndex.cached("essay_index.npz",essay_text)
+
+print(essay_index.count("binding of isaac"))
+print(essay_index.count("isaac asimov"))
+print(essay_index.count("asimov"))
+pd.Series(essay_index.following("isaac")).sort_values(ascending=False)
+
+
+# The same kind of discovery over the whole corpus, streaming the essays from the CSV in bounded memory:
+# the most frequent words and word pairs (Count-Min sketch + top-k), and the words used together with a word
+
+# In[ ]:
+
+
+with profiler.stage("essay stream statistics"):
+    essay_stats=sketch.stream_statistics(text.read_essays(PROFILES_CSV),vocabulary=words[:2000],k=1000)
+print(essay_stats.bigrams.most_common(30))
+essay_stats.cooccurrence.with_term("books",20)
 
 
 # ####  Mongo Queries Essays Patters 
@@ -806,20 +689,31 @@ cursor = collection.find().limit(50)
 pattern = "likes dogs"
 pattern3 = "sports" 
 pattern2 = "family" 
-pat = re.compile(pattern3, re.I)
+# Keywords and phrases are looked up in the essay5 token index; only real regular expressions scan the essays
+pat = search.essay_match("essay5", pattern3)
    
-pipeline1 = [{"$match": {"education":"graduated from college/university" , 'essay5': {'$regex': pat}}}]
+pipeline1 = [{"$match": {"education":"graduated from college/university" , **pat}}]
 
-pipeline2 = [{"$match": {"speaks":"english (fluently)" , 'essay5': {'$regex': pat}}}]
+pipeline2 = [{"$match": {"speaks":"english (fluently)" , **pat}}]
 
-pipeline3 = [{"$match": {"speaks":"spanish" , 'essay5': {'$regex': pat}}}]
+pipeline3 = [{"$match": {"speaks":"spanish" , **pat}}]
 
 
 # In[60]:
 
 
-aggResult = collection.aggregate(pipeline1)
-dfe = pd.DataFrame(list(aggResult))
+# The three pipelines, and the whole pattern x demographic grid, run concurrently on the client's connection pool:
+# the batch takes about as long as its slowest query (see okcupid.runner)
+demographics = {"college": {"education":"graduated from college/university"},   # the groups of pipeline1,
+                "english": {"speaks":"english (fluently)"},                     # pipeline2
+                "spanish": {"speaks":"spanish"}}                                # and pipeline3
+patterns = {"sports": pattern3, "family": pattern2, "dogs": pattern}
+with profiler.stage("query grid"):
+    results = runner.run_all(collection, runner.grid("essay5", patterns, demographics), concurrency=9, timeout=60,
+                             callback=lambda r: print("{} {}: {:.2f}s".format(*r.name, r.seconds)))
+print(pd.Series({name: len(r.documents) if r.error is None else r.error for name, r in results.items()}).unstack())
+
+dfe = pd.DataFrame(results[("sports", "college")].documents)
 dfe.head()
 
 
@@ -829,3 +723,13 @@ dfe.head()
 # Explore other specific patterns
 dfe["essay5"].str.extract("(\\bfootball [a-z]*\\b)").dropna()
 
+
+# Stage timings of this run, saved to compare runs after data refreshes
+# (timings.folded can be rendered with flamegraph.pl or speedscope)
+
+# In[ ]:
+
+
+profiler.save("timings.json")
+profiler.save_folded("timings.folded")
+profiler.summary()[["rows","wall_seconds","cpu_seconds","peak_rss","peak_rss_children","mongo_commands","mongo_seconds"]]
@@ -0,0 +1 @@
+"""Benchmarks of the analysis stages on synthetic OkCupid-shaped data (python -m benchmarks.run)."""
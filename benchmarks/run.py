@@ -0,0 +1,140 @@
+"""Time the stages of the analysis on synthetic profiles at several scales, and write the results as JSON.
+
+    python -m benchmarks.run --scale 1 10
+    python -m benchmarks.run --scale 10 100 --mongo mongodb://localhost:27017 --out results.json
+
+For each scale, a synthetic profiles.csv is generated (or reused from --data) and
+the stages below are timed with okcupid.timing; MongoDB stages run against a
+local mongod, or an in-process mongomock stand-in (--mongo mongomock, if the
+mongomock package is installed), and are skipped with --mongo none (the default).
+Results are appended to --out, one record per run, so throughput can be tracked
+across versions.
+
+The CSV is never loaded whole: the profile columns are read in chunks into
+compact dtypes (a few hundred bytes per row) and the essays are streamed from
+the file, so memory grows with the term matrix, not with the essay text
+(about 150 MB per unit of scale).
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import time
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from benchmarks import synthetic
+from okcupid import aggregate, dal, ingest, prevalence, text, timing
+
+ATTRIBUTES = ["body_type", "diet", "drinks", "drugs", "education", "job", "religion", "smokes"]
+
+
+def mongo_collection(uri, listeners=()):
+    """A fresh benchmark collection of a mongod (uri) or of mongomock (uri == "mongomock").
+
+    listeners are pymongo command listeners (mongomock sends no command events).
+    """
+    if uri == "mongomock":
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(uri, event_listeners=list(listeners))
+    collection = client.okcupid_benchmark.profiles
+    collection.drop()
+    return collection
+
+
+def version():
+    """git describe of the working tree, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_profiles(csv, chunksize=100000):
+    """The profile columns of csv (no essays) with compact dtypes, read chunksize rows at a time."""
+    frames = list(pd.read_csv(csv, usecols=lambda c: c in dal.PROFILE_COLUMNS, chunksize=chunksize,
+                              dtype=dict.fromkeys(dal.CATEGORICAL_COLUMNS, "category")))
+    columns = {c: union_categoricals([f[c] for f in frames]) if isinstance(frames[0][c].dtype, pd.CategoricalDtype)
+               else pd.concat([f[c] for f in frames], ignore_index=True) for c in frames[0]}
+    return dal.compact(pd.DataFrame(columns))
+
+
+def run(csv, mongo="none", n_words=10000, batch_size=2000):
+    """Time every stage on the profiles of csv; returns the timing.Profiler."""
+    profiler = timing.Profiler()
+    with profiler.stage("read_csv") as record:
+        profiles = read_profiles(csv)
+        record["rows"] = len(profiles)
+    rows = len(profiles)
+
+    if mongo != "none":
+        collection = mongo_collection(mongo, [profiler.mongo_listener()])
+        with profiler.stage("mongo_ingest", rows=rows):
+            ingest.load(collection, csv, batch_size=batch_size, verbose=False)
+        with profiler.stage("mongo_grouped_stats", rows=rows):
+            aggregate.count_by(collection, "sex")
+            aggregate.value_counts(collection, "age", by="sex")
+            aggregate.group_mean(collection, "height", ["sex", "age"])
+        collection.drop()
+
+    with profiler.stage("grouped_stats", rows=rows):
+        profiles.groupby(["sex", "age"], observed=True).size()
+        profiles.groupby(["sex", "age"], observed=True)["height"].agg(["mean", "median", "std"])
+
+    with profiler.stage("essays", rows=rows):
+        with profiler.stage("count_words", rows=rows):
+            wordcounts = text.count_words(text.read_essays(csv))
+        words = [w for w, c in wordcounts.most_common(n_words) if len(w) >= 4 and w.isalpha() and w != "href"]
+        with profiler.stage("d_contains", rows=rows):
+            matrix = text.term_matrix(text.read_essays(csv), words)
+            text.contains_frame(matrix, words)
+
+    with profiler.stage("compare_prevalence", rows=rows):
+        groups = {"m": profiles["sex"] == "m", "f": profiles["sex"] == "f",
+                  "under 30": profiles["age"] < 30, "30 and over": profiles["age"] >= 30}
+        prevalence.screen(profiles, ATTRIBUTES, groups, [("m", "f"), ("under 30", "30 and over")])
+    return profiler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, nargs="+", default=[1.0], help="scales, as multiples of profiles.csv")
+    parser.add_argument("--mongo", default="none", help="MongoDB URI, 'mongomock' or 'none'")
+    parser.add_argument("--data", default="benchmark_data", help="directory of the generated CSVs (kept for reuse)")
+    parser.add_argument("--out", default="benchmark_results.json", help="JSON file the results are appended to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.mongo == "mongomock" and importlib.util.find_spec("mongomock") is None:
+        parser.error("--mongo mongomock needs the mongomock package (pip install mongomock)")
+
+    os.makedirs(args.data, exist_ok=True)
+    results = []
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            results = json.load(f)
+    for scale in args.scale:
+        csv = os.path.join(args.data, "profiles_x{:g}_seed{}.csv".format(scale, args.seed))
+        if not os.path.exists(csv):
+            start = time.perf_counter()
+            rows = synthetic.write_csv(csv, scale=scale, seed=args.seed)
+            print("Generated {} rows in {:.1f}s".format(rows, time.perf_counter() - start))
+        profiler = run(csv, args.mongo)
+        report = profiler.report()
+        report.update(version=version(), scale=scale, seed=args.seed, mongo=args.mongo)
+        results.append(report)
+        for r in profiler.records:
+            print("x{:<6g} {:<30} {:8.2f}s {:>12}".format(
+                scale, r["path"], r["wall_seconds"], "{:.0f} rows/s".format(r["rows_per_sec"]) if "rows_per_sec" in r else ""))
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Synthetic profiles with the schema and (roughly) the distributions of profiles.csv, at any scale.
+
+    python -m benchmarks.synthetic --scale 10 --out profiles_x10.csv
+
+Categorical attributes are drawn from the frequencies of the real dataset
+(the most common values; the long tail is lumped into a few), ages and heights
+from per-sex distributions close to the real ones, and each of the ten essays
+has a log-normal length and Zipf distributed words, with the same kind of HTML
+markup (<br />, href) as the scraped text.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+ROWS = 59946  # rows of profiles.csv (scale 1)
+
+# Approximate value frequencies of profiles.csv (None is a missing value)
+CATEGORIES = {
+    "body_type": {"average": .24, "fit": .21, "athletic": .20, None: .09, "thin": .08, "curvy": .07, "a little extra": .04,
+                  "skinny": .03, "full figured": .02, "overweight": .01, "jacked": .01},
+    "diet": {None: .41, "mostly anything": .28, "anything": .10, "strictly anything": .09, "mostly vegetarian": .06,
+             "mostly other": .02, "strictly vegetarian": .02, "vegetarian": .01, "strictly other": .01},
+    "drinks": {"socially": .70, "rarely": .10, "often": .09, "not at all": .05, None: .05, "very often": .01},
+    "drugs": {"never": .63, None: .23, "sometimes": .13, "often": .01},
+    "education": {"graduated from college/university": .40, "graduated from masters program": .15, None: .11,
+                  "working on college/university": .10, "working on masters program": .03,
+                  "graduated from two-year college": .03, "graduated from high school": .02,
+                  "graduated from ph.d program": .02, "graduated from law school": .02, "dropped out of college/university": .12},
+    "ethnicity": {"white": .55, "asian": .10, None: .09, "hispanic / latin": .05, "black": .03, "other": .03,
+                  "hispanic / latin, white": .02, "indian": .02, "asian, white": .01, "white, other": .10},
+    "job": {"other": .13, "student": .08, "science / tech / engineering": .08, "computer / hardware / software": .08,
+            "artistic / musical / writer": .07, "sales / marketing / biz dev": .07, "medicine / health": .06,
+            "education / academia": .06, "executive / management": .04, "banking / financial / real estate": .04,
+            None: .14, "entertainment / media": .04, "law / legal services": .02, "hospitality / travel": .02,
+            "construction / craftsmanship": .02, "clerical / administrative": .01, "unemployed": .01,
+            "political / government": .01, "rather not say": .02},
+    "location": {"san francisco, california": .52, "oakland, california": .12, "berkeley, california": .07,
+                 "san mateo, california": .02, "palo alto, california": .02, "alameda, california": .02,
+                 "san rafael, california": .02, "hayward, california": .02, "emeryville, california": .02,
+                 "redwood city, california": .17},
+    "offspring": {None: .59, "doesn't have kids": .13, "doesn't have kids, but might want them": .06,
+                  "doesn't have kids, but wants them": .06, "doesn't want kids": .05, "has kids": .03,
+                  "has a kid": .03, "doesn't have kids, and doesn't want any": .05},
+    "orientation": {"straight": .86, "gay": .09, "bisexual": .05},
+    "pets": {None: .33, "likes dogs and likes cats": .24, "likes dogs": .12, "likes dogs and has cats": .07,
+             "has dogs": .07, "has dogs and likes cats": .04, "likes dogs and dislikes cats": .04,
+             "has dogs and has cats": .02, "has cats": .02, "likes cats": .01, "dislikes dogs and dislikes cats": .04},
+    "religion": {None: .34, "agnosticism": .07, "other": .06, "agnosticism but not too serious about it": .05,
+                 "agnosticism and laughing about it": .04, "catholicism but not too serious about it": .04,
+                 "atheism": .04, "other and laughing about it": .04, "atheism and laughing about it": .04,
+                 "christianity": .03, "christianity but not too serious about it": .03,
+                 "other but not too serious about it": .03, "judaism but not too serious about it": .02,
+                 "atheism but not too serious about it": .02, "catholicism": .02, "buddhism": .05},
+    "sign": {None: .18, "gemini and it's fun to think about": .03, "scorpio and it's fun to think about": .03,
+             "leo and it's fun to think about": .03, "libra and it's fun to think about": .03,
+             "taurus and it's fun to think about": .03, "cancer and it's fun to think about": .03,
+             "pisces and it's fun to think about": .03, "sagittarius and it's fun to think about": .03,
+             "virgo and it's fun to think about": .03, "aries and it's fun to think about": .03,
+             "aquarius and it's fun to think about": .03, "capricorn and it's fun to think about": .02,
+             "leo but it doesn't matter": .03, "gemini": .03, "virgo": .03, "leo": .03, "libra": .03,
+             "cancer": .03, "scorpio": .03, "aries": .03, "taurus": .03, "pisces": .03, "sagittarius": .03,
+             "aquarius": .03, "capricorn": .03, "gemini but it doesn't matter": .04},
+    "smokes": {"no": .73, None: .09, "sometimes": .06, "when drinking": .05, "yes": .04, "trying to quit": .03},
+    "speaks": {"english": .36, "english (fluently)": .11, "english (fluently), spanish (poorly)": .04,
+               "english (fluently), spanish (okay)": .03, "english (fluently), spanish (fluently)": .02,
+               "english, spanish": .02, "english (fluently), french (poorly)": .02, "english, french": .01,
+               "english, spanish (okay)": .01, "english, spanish (poorly)": .02,
+               "english (fluently), chinese (fluently)": .01, "spanish": .01, "english, other": .34},
+    "status": {"single": .93, "seeing someone": .03, "available": .03, "married": .01},
+}
+
+# Common words of the essays, most frequent first; rarer words are generated from syllables
+COMMON_WORDS = ("i and the to a of my in you me is it that with for love like be have but am on not about "
+                "friends people life music good time new food things just or all so can do what are movies "
+                "books family someone who travel really being fun out going dogs sports working hiking cooking "
+                "isaac asimov href ilink san francisco city bay night friday home wine beer coffee art").split()
+SYLLABLES = ["ka", "lo", "mi", "ra", "te", "su", "no", "be", "di", "fo", "ga", "hu", "ji", "ke", "ly", "pa",
+             "qui", "ro", "sa", "tu", "vi", "we", "xo", "ya", "ze", "an", "el", "in", "on", "un"]
+ESSAY_MISSING = [.09, .13, .16, .19, .18, .18, .23, .21, .32, .21]  # fraction of missing values of essay0..essay9
+ESSAY_WORDS = [80, 40, 35, 20, 70, 30, 25, 20, 15, 25]  # median length of essay0..essay9, in words
+
+
+def vocabulary(size=50000, rng=None):
+    """COMMON_WORDS followed by distinct made-up words, size words in all."""
+    rng = np.random.default_rng(rng)
+    words = dict.fromkeys(COMMON_WORDS)
+    while len(words) < size:
+        syllables = rng.integers(0, len(SYLLABLES), size=(size, 4))
+        lengths = rng.integers(2, 5, size=size)
+        words.update(dict.fromkeys("".join(SYLLABLES[i] for i in row[:k]) for row, k in zip(syllables.tolist(), lengths)))
+    return np.array(list(words)[:size], dtype=object)
+
+
+def _categorical(values, n, rng):
+    p = np.array(list(values.values()), dtype=float)
+    return rng.choice(np.array(list(values), dtype=object), n, p=p / p.sum())
+
+
+def _essays(n, median, missing, words, rng, zipf=1.0):
+    lengths = np.maximum(1, rng.lognormal(np.log(median), 0.8, n)).astype(np.int64)
+    # Zipf's law over the finite vocabulary: the frequency of the word of rank r is proportional to 1 / r ** zipf
+    p = 1 / np.arange(1, len(words) + 1) ** zipf
+    tokens = words[rng.choice(len(words), lengths.sum(), p=p / p.sum())]
+    # Line breaks are scraped as "<br />\n", like in profiles.csv
+    tokens[rng.random(len(tokens)) < 0.03] = "<br />\n"
+    ends = np.cumsum(lengths)
+    essays = np.array([" ".join(tokens[a:b]) for a, b in zip(ends - lengths, ends)], dtype=object)
+    essays[rng.random(n) < missing] = None
+    return essays
+
+
+def profiles(n, rng=None, words=None):
+    """A DataFrame of n synthetic profiles, with the columns of profiles.csv."""
+    rng = np.random.default_rng(rng)
+    words = vocabulary(rng=rng) if words is None else words
+    sex = rng.choice(np.array(["m", "f"], dtype=object), n, p=[.6, .4])
+    male = sex == "m"
+    frame = {"age": np.clip(np.round(18 + rng.gamma(2.2, 6.5, n)), 18, 69).astype(np.int64),
+             "height": np.round(np.where(male, 70.4, 65.1) + rng.normal(0, 3, n))}
+    frame["height"][rng.random(n) < 5e-5] = np.nan
+    for c, values in CATEGORIES.items():
+        frame[c] = _categorical(values, n, rng)
+    frame["sex"] = sex
+    income = rng.choice([20000, 30000, 40000, 50000, 60000, 70000, 80000, 100000, 150000, 1000000], n)
+    frame["income"] = np.where(rng.random(n) < .81, -1, income)
+    frame["last_online"] = (pd.Timestamp("2012-06-30") - pd.to_timedelta(rng.integers(0, 365 * 24 * 60, n), unit="min")
+                            ).strftime("%Y-%m-%d-%H-%M")
+    for i, (median, missing) in enumerate(zip(ESSAY_WORDS, ESSAY_MISSING)):
+        frame["essay" + str(i)] = _essays(n, median, missing, words, rng)
+    return pd.DataFrame(frame)[sorted(frame)]
+
+
+def write_csv(path, rows=ROWS, scale=None, chunksize=50000, seed=0):
+    """Write rows (or scale x ROWS) synthetic profiles to path, generated chunksize rows at a time."""
+    rows = int(round(scale * ROWS)) if scale is not None else rows
+    rng = np.random.default_rng(seed)
+    words = vocabulary(rng=rng)
+    for start in range(0, rows, chunksize):
+        chunk = profiles(min(chunksize, rows - start), rng, words)
+        chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="number of rows, as a multiple of profiles.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="profiles_synthetic.csv")
+    args = parser.parse_args(argv)
+    print("Wrote {} profiles to {}".format(write_csv(args.out, scale=args.scale, seed=args.seed), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Helpers for the OkCupid use case analysis (OkCupid_TotalAnalysis.py)."""
@@ -0,0 +1,78 @@
+"""Summary statistics computed inside MongoDB, so that only the aggregates leave the server."""
+
+import pandas as pd
+import pymongo
+
+
+def _match(match, field=None):
+    match = dict(match or {})
+    if field is not None:
+        match.setdefault(field, {"$ne": None})
+    return [{"$match": match}] if match else []
+
+
+def _group_id(by):
+    by = [by] if isinstance(by, str) else list(by)
+    return {b: "$" + b for b in by}, by
+
+
+def count(collection, match=None):
+    """Number of documents matching match."""
+    return collection.count_documents(match or {})
+
+
+def count_by(collection, by, match=None):
+    """Number of documents for each value of the by field(s), as a Series."""
+    group_id, by = _group_id(by)
+    pipeline = _match(match) + [{"$group": {"_id": group_id, "n": {"$sum": 1}}}]
+    rows = [dict(r["_id"], n=r["n"]) for r in collection.aggregate(pipeline)]
+    return pd.DataFrame(rows, columns=by + ["n"]).set_index(by)["n"].sort_index()
+
+
+def value_counts(collection, field, by=None, match=None):
+    """Number of documents for each distinct value of field (within each group of by)."""
+    by = [] if by is None else [by] if isinstance(by, str) else list(by)
+    return count_by(collection, by + [field], _match(match, field)[0]["$match"])
+
+
+def histogram(collection, field, boundaries, match=None):
+    """Counts of field in the buckets [boundaries[i], boundaries[i+1]), as a Series indexed by lower bound."""
+    boundaries = list(boundaries)
+    pipeline = _match(match, field) + [{"$bucket": {"groupBy": "$" + field, "boundaries": boundaries,
+                                                    "default": "other", "output": {"n": {"$sum": 1}}}}]
+    counts = {r["_id"]: r["n"] for r in collection.aggregate(pipeline) if r["_id"] != "other"}
+    return pd.Series([counts.get(b, 0) for b in boundaries[:-1]], index=boundaries[:-1], name=field)
+
+
+def group_mean(collection, field, by, match=None):
+    """Mean of field for each group of the by field(s), as a Series (like d.groupby(by)[field].mean())."""
+    group_id, by = _group_id(by)
+    pipeline = _match(match, field) + [{"$group": {"_id": group_id, field: {"$avg": "$" + field}}}]
+    rows = [dict(r["_id"], **{field: r[field]}) for r in collection.aggregate(pipeline)]
+    return pd.DataFrame(rows, columns=by + [field]).set_index(by)[field].sort_index()
+
+
+def median(collection, field, match=None):
+    """Median of field, reading at most the two middle values (uses an index on field when there is one)."""
+    match = _match(match, field)[0]["$match"]
+    n = collection.count_documents(match)
+    if n == 0:
+        return float("nan")
+    cursor = (collection.find(match, {field: 1, "_id": 0})
+              .sort(field, pymongo.ASCENDING).skip((n - 1) // 2).limit(2 - n % 2))
+    values = [doc[field] for doc in cursor]
+    return sum(values) / len(values)
+
+
+def describe(collection, field, match=None):
+    """count, mean, std, min, median and max of field, like Series.describe()."""
+    pipeline = _match(match, field) + [{"$group": {"_id": None,
+                                                   "count": {"$sum": 1},
+                                                   "mean": {"$avg": "$" + field},
+                                                   "std": {"$stdDevSamp": "$" + field},
+                                                   "min": {"$min": "$" + field},
+                                                   "max": {"$max": "$" + field}}}]
+    stats = next(collection.aggregate(pipeline), {"count": 0})
+    stats.pop("_id", None)
+    stats["50%"] = median(collection, field, match)
+    return pd.Series(stats, name=field).reindex(["count", "mean", "std", "min", "50%", "max"])
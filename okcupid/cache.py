@@ -0,0 +1,137 @@
+"""Content-addressed on-disk cache of the essay features (concatenated essays, word counts, term matrix).
+
+An entry is keyed by a hash of the essay data and of the pipeline parameters, so a
+re-run over the same snapshot with the same parameters skips the text pipeline,
+while any change to the data or the parameters is a miss. Entries are directories
+of .npz files, and the least recently used ones are evicted beyond a size cap.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from okcupid import text
+
+# Version of the layout of the entries, part of every key: entries of an older layout are misses
+FORMAT = 2
+
+
+def encode_strings(strings):
+    """A list of strings as one UTF-8 buffer (uint8 array) and an offsets array, storable without pickle."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_strings(buffer, offsets):
+    buffer = buffer.tobytes()
+    return [buffer[a:b].decode("utf-8") for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def save_strings(path, strings):
+    """Save a list of strings as one UTF-8 buffer and an offsets array."""
+    buffer, offsets = encode_strings(strings)
+    np.savez(path, buffer=buffer, offsets=offsets)
+
+
+def load_strings(path):
+    with np.load(path) as f:
+        return decode_strings(f["buffer"], f["offsets"])
+
+
+def data_key(frame, **params):
+    """Hash of the content of frame (values and column names, not the index) and of the parameters."""
+    h = hashlib.sha256()
+    h.update(json.dumps(list(map(str, frame.columns))).encode())
+    h.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    h.update(json.dumps(params, sort_keys=True, default=list).encode())
+    return h.hexdigest()[:32]
+
+
+class FeatureCache:
+    """Directory of cache entries, each holding the EssayFeatures of one (data, parameters) key."""
+
+    def __init__(self, root=".okcupid_cache", max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """The cached EssayFeatures of key, or None."""
+        path = self._path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)  # mark as recently used
+        essays = text.EssayBuffer.load(os.path.join(path, "essays.npz"))
+        with np.load(os.path.join(path, "wordcounts.npz")) as f:
+            counts = f["counts"].tolist()
+        wordcounts = Counter(dict(zip(load_strings(os.path.join(path, "wordcounts_words.npz")), counts)))
+        words = load_strings(os.path.join(path, "words.npz"))
+        matrix = sparse.load_npz(os.path.join(path, "matrix.npz"))
+        return text.EssayFeatures(essays, wordcounts, words, matrix)
+
+    def put(self, key, features):
+        # Write to a temporary directory first, so that readers never see a partial entry
+        tmp = self._path(key) + ".tmp{}".format(os.getpid())
+        os.makedirs(tmp, exist_ok=True)
+        features.essays.save(os.path.join(tmp, "essays.npz"))
+        save_strings(os.path.join(tmp, "wordcounts_words.npz"), list(features.wordcounts))
+        np.savez(os.path.join(tmp, "wordcounts.npz"), counts=np.fromiter(features.wordcounts.values(), np.int64))
+        save_strings(os.path.join(tmp, "words.npz"), features.words)
+        sparse.save_npz(os.path.join(tmp, "matrix.npz"), features.matrix.tocsr())
+        if os.path.isdir(self._path(key)):
+            shutil.rmtree(tmp)
+        else:
+            os.replace(tmp, self._path(key))
+        self.evict()
+
+    def entries(self):
+        """(last use time, size in bytes, key) of every entry, least recently used first."""
+        entries = []
+        for key in os.listdir(self.root):
+            path = self._path(key)
+            if os.path.isdir(path) and ".tmp" not in key:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, key))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries[:-1]:  # never evict the newest entry
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+
+def essay_features(frame, cache=None, verbose=True, **params):
+    """text.essay_features(frame, **params), read from / written to cache when one is given.
+
+    With verbose=True, a line says whether the features were computed or loaded.
+    """
+    if cache is None:
+        return text.essay_features(frame, **params)
+    start = time.perf_counter()
+    key = data_key(frame[text.ESSAY_COLUMNS], format=FORMAT, **params)
+    features = cache.get(key)
+    hit = features is not None
+    if not hit:
+        features = text.essay_features(frame, **params)
+        cache.put(key, features)
+    if verbose:
+        print("{} essay features {} in {:.1f}s".format(
+            "Loaded" if hit else "Computed", key + (" from the cache" if hit else ""), time.perf_counter() - start))
+    return features
@@ -0,0 +1,88 @@
+"""Correlations between numeric columns of the profiles (age, height, income), for all pairs and groups at once.
+
+Kendall tau-b comes from scipy.stats.kendalltau, which sorts and counts discordant
+pairs with a merge sort (O(n log n)), so it runs on all users; larger inputs can be
+subsampled, with confidence intervals bounding the error. matrix computes the
+Spearman or Pearson correlations of all pairs from one ranking of each column.
+Results are tables, decoupled from plotting.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+METHODS = ("kendall", "spearman", "pearson")
+
+# Asymptotic variance factors of atanh(r) times (n - 3), or (n - 4) for tau
+# (Fieller, Hartley and Pearson, 1957), used for the confidence intervals
+_FISHER = {"pearson": (1.0, 3), "spearman": (1.06, 3), "kendall": (0.437, 4)}
+
+
+def correlate(x, y, method="kendall"):
+    """(statistic, p-value) of two numeric arrays without missing values."""
+    if method == "kendall":
+        result = stats.kendalltau(x, y)  # tau-b
+    elif method == "spearman":
+        result = stats.spearmanr(x, y)
+    elif method == "pearson":
+        result = stats.pearsonr(x, y)
+    else:
+        raise ValueError("unknown method {!r}, expected one of {}".format(method, METHODS))
+    return float(result[0]), float(result[1])
+
+
+def interval(r, n, method, ci=0.95):
+    """Approximate (stderr, low, high) of a correlation r over n rows, from the Fisher transformation."""
+    factor, dof = _FISHER[method]
+    n = np.asarray(n, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt(factor / (n - dof))
+        z = np.arctanh(np.clip(r, -1 + 1e-12, 1 - 1e-12))
+    half = stats.norm.ppf((1 + ci) / 2) * se
+    return se, np.tanh(z - half), np.tanh(z + half)
+
+
+def pairs(frame, columns=None, methods=METHODS, by=None, sample=None, rng=None, min_count=10, ci=0.95):
+    """Correlation of every pair of numeric columns, for every group of the by columns.
+
+    Rows with a missing value in either column of a pair are dropped for that pair.
+    With sample, groups larger than sample rows are subsampled (without
+    replacement) before computing the statistics: the confidence intervals
+    (from the number of rows actually used) then bound the sampling error.
+    Returns one row per (group, x, y, method) with n, statistic, pvalue, stderr,
+    low and high columns; groups of fewer than min_count rows are skipped.
+    """
+    rng = np.random.default_rng(rng)
+    if columns is None:
+        columns = [c for c in frame.columns if c not in (by or []) and pd.api.types.is_numeric_dtype(frame[c])]
+    groups = frame.groupby(by, observed=True) if by else [((), frame)]
+    rows = []
+    for key, group in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        if sample is not None and len(group) > sample:
+            group = group.iloc[np.sort(rng.choice(len(group), sample, replace=False))]
+        values = group[list(columns)].astype(float)
+        for x, y in itertools.combinations(columns, 2):
+            xy = values[[x, y]].dropna()
+            if len(xy) < min_count:
+                continue
+            for method in methods:
+                statistic, pvalue = correlate(xy[x].to_numpy(), xy[y].to_numpy(), method)
+                rows.append(key + (x, y, method, len(xy), statistic, pvalue))
+    names = list(by or []) + ["x", "y", "method"]
+    result = pd.DataFrame([row + (np.nan,) * 3 for row in rows],
+                          columns=names + ["n", "statistic", "pvalue", "stderr", "low", "high"])
+    for method, sel in result.groupby("method").groups.items():
+        se, low, high = interval(result.loc[sel, "statistic"].to_numpy(), result.loc[sel, "n"].to_numpy(), method, ci)
+        result.loc[sel, "stderr"], result.loc[sel, "low"], result.loc[sel, "high"] = se, low, high
+    return result.set_index(names)
+
+
+def matrix(frame, columns=None, method="spearman", min_count=10):
+    """Square matrix of the pairwise correlations of the columns (Spearman or Pearson, all pairs in one call)."""
+    frame = frame if columns is None else frame[list(columns)]
+    if method not in ("spearman", "pearson"):
+        raise ValueError("matrix supports spearman and pearson, use pairs for {!r}".format(method))
+    return frame.astype(float).corr(method=method, min_periods=min_count)
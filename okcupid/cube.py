@@ -0,0 +1,137 @@
+"""Pre-aggregated cube of the profiles over low cardinality dimensions (sex, age, body_type, ...).
+
+Every cell (one combination of dimension values) holds the number of users, and
+for each measure (e.g. height) the number of non-missing values, their sum and
+sum of squares, plus a histogram over fixed bins. These are all additive, so any
+roll-up to fewer dimensions is a sum of cells, means and variances follow from
+the sums, and new profiles are added to an existing cube without a rescan.
+Missing dimension values are kept as cells of their own, so totals are exact.
+
+    c = cube.Cube.build(d, ["sex", "age", "body_type"], {"height": range(36, 96)})
+    c.rollup(["sex", "age"]).count()        # users per sex and age
+    c.rollup(["sex", "age"]).mean("height")
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Cube:
+    """The cells of a cube: a DataFrame indexed by the dimensions, and one histogram DataFrame per measure."""
+
+    def __init__(self, cells, histograms, dims, bins):
+        self.cells = cells
+        self.histograms = histograms
+        self.dims = list(dims)
+        self.bins = {m: np.asarray(edges) for m, edges in bins.items()}
+
+    @property
+    def measures(self):
+        return list(self.bins)
+
+    @classmethod
+    def build(cls, frame, dims, bins):
+        """Aggregate the rows of frame in one pass.
+
+        bins maps every measure column to the edges of its histogram bins (values
+        outside the edges are counted in the sums, but not in the histogram).
+        """
+        dims = list(dims)
+        groups = frame.groupby(dims, observed=True, dropna=False, sort=True)
+        codes = groups.ngroup().to_numpy()
+        index = groups.size().index
+        n = len(index)
+        columns = {"count": np.bincount(codes, minlength=n)}
+        histograms = {}
+        for m, edges in bins.items():
+            edges = np.asarray(edges)
+            values = frame[m].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            v = np.where(valid, values, 0)
+            columns[m + "_n"] = np.bincount(codes, weights=valid, minlength=n).astype(np.int64)
+            columns[m + "_sum"] = np.bincount(codes, weights=v, minlength=n)
+            columns[m + "_sumsq"] = np.bincount(codes, weights=v * v, minlength=n)
+            b = np.searchsorted(edges, values, side="right") - 1
+            inside = valid & (b >= 0) & (b < len(edges) - 1)
+            counts = np.bincount(codes[inside] * (len(edges) - 1) + b[inside], minlength=n * (len(edges) - 1))
+            histograms[m] = pd.DataFrame(counts.reshape(n, len(edges) - 1), index=index, columns=edges[:-1])
+        return cls(pd.DataFrame(columns, index=index), histograms, dims, bins)
+
+    def _new(self, cells, histograms, dims):
+        return type(self)(cells, histograms, dims, self.bins)
+
+    def rollup(self, dims):
+        """The cube summed over all the dimensions not in dims."""
+        dims = list(dims)
+        if not dims:  # grand total, as a single cell
+            return self._new(self.cells.sum().to_frame().T.astype(self.cells.dtypes),
+                             {m: h.sum().to_frame().T for m, h in self.histograms.items()}, [])
+        return self._new(self.cells.groupby(level=dims, dropna=False, observed=True).sum(),
+                         {m: h.groupby(level=dims, dropna=False, observed=True).sum()
+                          for m, h in self.histograms.items()}, dims)
+
+    def filter(self, **conditions):
+        """The cells whose dimensions satisfy the conditions: a value, a list of values or a predicate per dimension."""
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dim, condition in conditions.items():
+            values = self.cells.index.get_level_values(dim)
+            if callable(condition):
+                mask &= np.asarray(condition(values), dtype=bool)
+            elif isinstance(condition, (list, tuple, set)):
+                mask &= values.isin(list(condition))
+            else:
+                mask &= values == condition
+        return self._new(self.cells[mask], {m: h[mask] for m, h in self.histograms.items()}, self.dims)
+
+    def slice(self, **values):
+        """The cube at fixed values of some dimensions, which are dropped."""
+        return self.filter(**values).rollup([d for d in self.dims if d not in values])
+
+    def count(self):
+        """Number of users in each cell."""
+        return self.cells["count"]
+
+    def mean(self, measure):
+        return self.cells[measure + "_sum"] / self.cells[measure + "_n"]
+
+    def var(self, measure):
+        """Sample variance of a measure in each cell."""
+        n, s, ss = (self.cells[measure + suffix] for suffix in ("_n", "_sum", "_sumsq"))
+        return (ss - s * s / n) / (n - 1)
+
+    def std(self, measure):
+        return np.sqrt(self.var(measure))
+
+    def histogram(self, measure):
+        """Counts per bin of a measure (columns are the lower bin edges) in each cell."""
+        return self.histograms[measure]
+
+    def quantile(self, measure, q):
+        """Approximate quantiles q of a measure in each cell, interpolated within the histogram bins."""
+        edges = self.bins[measure]
+        counts = self.histograms[measure].to_numpy(dtype=float)
+        cumulative = np.concatenate([np.zeros((len(counts), 1)), np.cumsum(counts, axis=1)], axis=1)
+        result = {}
+        for p in np.atleast_1d(q):
+            result[p] = [np.interp(p * c[-1], c, edges) if c[-1] else np.nan for c in cumulative]
+        return pd.DataFrame(result, index=self.cells.index)
+
+    def add(self, other):
+        """The sum of two cubes with the same dimensions and bins (e.g. the cube of new profiles)."""
+        if other.dims != self.dims or set(other.bins) != set(self.bins) or any(
+                not np.array_equal(other.bins[m], self.bins[m]) for m in self.bins):
+            raise ValueError("cubes have different dimensions or bins")
+        return self._new(self.cells.add(other.cells, fill_value=0).astype(self.cells.dtypes).sort_index(),
+                         {m: h.add(other.histograms[m], fill_value=0).astype(np.int64).sort_index()
+                          for m, h in self.histograms.items()}, self.dims)
+
+    def update(self, frame):
+        """The cube with the rows of frame (new profiles) added."""
+        return self.add(Cube.build(frame, self.dims, self.bins))
+
+    def save(self, path):
+        pd.to_pickle(self, path)
+
+    @classmethod
+    def load(cls, path):
+        return pd.read_pickle(path)
@@ -0,0 +1,65 @@
+"""Typed, projection-aware access to the profiles stored in the okcupid collection."""
+
+import numpy as np
+import pandas as pd
+import pymongo
+
+from okcupid import layout
+from okcupid.text import ESSAY_COLUMNS
+
+# Low cardinality text attributes, loaded as pandas categoricals
+CATEGORICAL_COLUMNS = ["body_type", "diet", "drinks", "drugs", "education", "ethnicity", "job", "location",
+                       "offspring", "orientation", "pets", "religion", "sex", "sign", "smokes", "speaks", "status"]
+
+# Integer attributes and the smallest dtype holding all their values
+INTEGER_COLUMNS = {"age": np.int16, "height": np.int8, "income": np.int32}
+
+PROFILE_COLUMNS = sorted(CATEGORICAL_COLUMNS + list(INTEGER_COLUMNS) + ["last_online"])
+
+
+def compact(frame):
+    """Convert the known columns of frame to compact dtypes, in place.
+
+    Integer columns with missing values (e.g. height) can't be stored as numpy
+    integers and become float32 instead.
+    """
+    for c in frame.columns:
+        if c in CATEGORICAL_COLUMNS:
+            frame[c] = frame[c].astype("category")
+        elif c in INTEGER_COLUMNS:
+            values = pd.to_numeric(frame[c])
+            frame[c] = values.astype(INTEGER_COLUMNS[c] if values.notna().all() else np.float32)
+    return frame
+
+
+class ProfileStore:
+    """Load the columns a computation needs from the profiles collection, and nothing else.
+
+    Documents are always read in _id order, so frames returned by successive
+    load() calls with the same match are row-aligned and can be joined. With the
+    hot/cold layout (see okcupid.layout), essays are read from their own collection.
+    """
+
+    def __init__(self, collection, essays=None):
+        self.collection = collection
+        self.essays_collection = essays
+
+    def load(self, columns=PROFILE_COLUMNS, match=None, batch_size=10000):
+        columns = list(columns)
+        projection = dict.fromkeys(columns, 1)
+        projection["_id"] = 1 if "_id" in columns else 0
+        cursor = (self.collection.find(match or {}, projection)
+                  .sort("_id", pymongo.ASCENDING).batch_size(batch_size))
+        frame = pd.DataFrame(list(cursor), columns=columns)
+        return compact(frame)
+
+    def profiles(self, match=None):
+        """All the attributes except the essays."""
+        return self.load(PROFILE_COLUMNS, match)
+
+    def essays(self, match=None):
+        """The ten essay columns."""
+        if self.essays_collection is None:
+            return self.load(ESSAY_COLUMNS, match)
+        ids = self.load(["_id"], match)["_id"]
+        return layout.fetch_essays(self.essays_collection, ids).reset_index(drop=True)
@@ -0,0 +1,279 @@
+"""The figures of the analysis. Each function draws one figure from precomputed data and returns it."""
+
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+from matplotlib.colors import PowerNorm
+
+
+def _age_bins(ages):
+    age = ages.index.get_level_values("age")
+    return range(int(age.min()), int(age.max()))
+
+
+def age_histograms(ages):
+    """Age histograms of males and females, from the number of users per (sex, age)."""
+    bins = _age_bins(ages)
+    fig, (ax1, ax2) = plt.subplots(ncols=2, figsize=(10, 3), sharey=True, sharex=True)
+    ax1.hist(ages["m"].index, weights=ages["m"].values, bins=bins, color="g", alpha=0.4)
+    ax1.set_title("Age distribution for males")
+    ax2.hist(ages["f"].index, weights=ages["f"].values, bins=bins, color="b", alpha=0.4)
+    ax2.set_title("Age distribution for females")
+    ax1.set_ylabel("Number of users in age group")
+    for ax in (ax1, ax2):
+        sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def age_comparison(ages):
+    """Both age distributions on the same axis, and the percentage of males in each age group."""
+    bins = _age_bins(ages)
+    fig, (ax1, ax2) = plt.subplots(nrows=2, figsize=(10, 6), sharex=True)
+    # Plot the age distributions of males and females on the same axis
+    ax1.hist(ages["m"].index, weights=ages["m"].values, bins=bins, color="g", alpha=0.4, label="males")
+    ax1.hist(ages["f"].index, weights=ages["f"].values, bins=bins, color="b", alpha=0.4, label="females")
+    ax1.set_ylabel("Number of users in age group")
+    ax1.set_xlabel("")
+    ax1.legend()
+
+    # Compute the fraction of males for every age value
+    total = ages.groupby(level="age").sum()
+    fraction_of_males = (ages["m"] / total).reindex(total.index)
+    # Ignore values computed from age groups in which we have less than 100 total users (else estimates are too unstable)
+    fraction_of_males[total < 100] = None
+    barlist = ax2.bar(x=fraction_of_males.index,
+                      height=fraction_of_males * 100 - 50,
+                      bottom=50, width=1, color="gray")
+    for bar, frac in zip(barlist, fraction_of_males):
+        bar.set_color("g" if frac > .5 else "b")
+        bar.set_alpha(0.4)
+    ax2.set_xlim([18, 70])
+    ax2.set_xlabel("age")
+    ax2.set_ylabel("percentage of males in age group")
+    ax2.axhline(y=50, color="k")
+
+    for ax in (ax1, ax2):
+        sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def _box_stats(counts, label):
+    # The statistics of a boxplot (as computed by matplotlib) of values repeated counts times
+    values = counts.index.to_numpy(dtype=float)[counts.to_numpy() > 0]
+    counts = counts.to_numpy()[counts.to_numpy() > 0]
+    cumulative = np.cumsum(counts)
+
+    def percentile(p):
+        # Linear interpolation between the order statistics, like np.percentile
+        position = p / 100 * (cumulative[-1] - 1)
+        lo, hi = np.searchsorted(cumulative, [np.floor(position) + 1, np.ceil(position) + 1])
+        return values[lo] + (values[hi] - values[lo]) * (position - np.floor(position))
+    q1, med, q3 = percentile(25), percentile(50), percentile(75)
+    inside = (values >= q1 - 1.5 * (q3 - q1)) & (values <= q3 + 1.5 * (q3 - q1))
+    return {"label": label, "q1": q1, "med": med, "q3": q3,
+            "whislo": values[inside].min(), "whishi": values[inside].max(), "fliers": values[~inside]}
+
+
+def height_distribution(heights):
+    """Height histograms of males and females, with aligned boxplots.
+
+    heights is the number of users of each height (columns) for each sex (rows).
+    """
+    fig, (ax, ax2) = plt.subplots(nrows=2, sharex=True, figsize=(6, 6), gridspec_kw={"height_ratios": [2, 1]})
+    # Plot histograms of height
+    bins = range(55, 80)
+    for sex, color, label in (("m", "g", "males"), ("f", "b", "females")):
+        ax.hist(heights.columns, weights=heights.loc[sex], bins=bins, color=color, alpha=0.4, label=label)
+    ax.legend(loc="upper left")
+    ax.set_xlabel("")
+    ax.set_ylabel("Number of users with given height")
+    ax.set_title("height distribution of male and female users")
+
+    # Make aligned boxplots
+    boxes = ax2.bxp([_box_stats(heights.loc[sex], sex) for sex in ("m", "f")], vert=False, patch_artist=True,
+                    flierprops={"marker": "d", "markersize": 4})
+    for box, color in zip(boxes["boxes"], ("g", "b")):
+        box.set(facecolor=color, alpha=.5)
+    ax2.set_xlim([min(bins), max(bins)])
+    ax2.set_xlabel("Self-reported height [inches]")
+    ax2.set_ylabel("sex")
+
+    sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def percentile_comparison(stats):
+    """Height percentiles of 20-year-old users vs CDC data (stats indexed by sex and percentile)."""
+    fig, (ax1, ax2) = plt.subplots(ncols=2, sharex=True, figsize=(10, 4))
+    for sex, ax, colors in (("m", ax1, ["b", "grey"]), ("f", ax2, ["g", "lightgrey"])):
+        s = stats.loc[sex]
+        yerr = None
+        if "users_low" in s:  # bootstrap confidence intervals of the users' percentiles
+            yerr = {"users": np.array([s["users"] - s["users_low"], s["users_high"] - s["users"]])}
+        s[["users", "CDC"]].plot.bar(ax=ax, color=colors, alpha=1, width=0.8, rot=0, yerr=yerr, capsize=2)
+    ax1.set_ylim([64, 77])
+    ax2.set_ylim([58, 71])
+    ax1.set_ylabel("Height [inches]")
+    ax2.set_ylabel("Height [inches]")
+    ax1.set_title("Height percentiles in 20y-old male users vs CDC data")
+    ax2.set_title("Height percentiles in 20y-old female users vs CDC data")
+    for ax in (ax1, ax2):
+        sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def height_vs_age(g):
+    """Average height vs age, from the mean height per (sex, age)."""
+    fig, (ax1, ax2) = plt.subplots(ncols=2, sharex=True, figsize=(10, 3))
+    ax1.plot(g["m"], color="g")
+    ax1.set_xlim(18, 27)
+    ax1.set_ylim(69.5, 71)
+    ax1.set(title="Average height vs age for males", ylabel="height", xlabel="age")
+    ax2.plot(g["f"], color="b")
+    ax2.set_xlim(18, 27)
+    ax2.set_ylim(64, 65.5)
+    ax2.set(title="Average height vs age for females", ylabel="height", xlabel="age")
+    for ax in (ax1, ax2):
+        sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def _height_vs_cdc(ax, g, cdc, sex, color, ylim):
+    name = {"m": "male", "f": "female"}[sex]
+    ax.plot(g, color=color, label="Mean of {} OkCupid users".format(name))
+    ax.plot(cdc["P75"], color="k", linestyle="dotted", label="75th percentile of {} US Population".format(name))
+    ax.plot(cdc["P50"], color="k", label="Median of {} US Population".format(name))
+    ax.plot(cdc["P25"], color="k", linestyle="dotted", label="25th percentile of {} US Population".format(name))
+    ax.fill_between(cdc.index, cdc["P25"], cdc["P75"], color="k", alpha=0.1, linewidth=0)
+
+    # Use direct labeling instead of a legend
+    x = cdc["P50"].index[-1]
+    ax.text(x, g.loc[:26].max(), " Mean of {} OkCupid users".format(name), color=color,
+            verticalalignment="bottom", fontsize="small")
+    ax.text(x, cdc["P75"].iloc[-1], " 75th percentile of {} US Population".format(name),
+            verticalalignment="center", fontsize="small")
+    ax.text(x, cdc["P50"].iloc[-1], " Median of {} US Population".format(name),
+            verticalalignment="center", fontsize="small")
+    ax.text(x, cdc["P25"].iloc[-1], " 25th percentile of {} US Population".format(name),
+            verticalalignment="center", fontsize="small")
+
+    ax.set_xlim(16, 27)
+    ax.set_ylim(*ylim)
+    ax.set(title="height vs age for {}s".format(name),
+           ylabel="height [inches]",
+           xlabel="age (rounded down for CDC data) [years]")
+
+
+def height_vs_cdc(g, cdc_m, cdc_f):
+    """Mean height per age of users, overlaid on the CDC growth chart percentiles."""
+    fig, (ax1, ax2) = plt.subplots(ncols=2, sharex=True, figsize=(10, 5))
+    _height_vs_cdc(ax1, g["m"], cdc_m, "m", "g", (67, 72))
+    _height_vs_cdc(ax2, g["f"], cdc_f, "f", "b", (62, 67))
+    for ax in (ax1, ax2):
+        sns.despine(ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def body_type_counts(counts):
+    """Number of female and male users self-reporting each body type (counts is indexed by sex and body_type)."""
+    fig, ax = plt.subplots(figsize=(6, 5))
+    counts = counts.rename("count").reset_index()
+    sns.barplot(y="body_type", x="count", hue="sex",
+                order=counts.groupby("body_type", observed=True)["count"].sum().sort_values(ascending=False).index,
+                data=counts, palette={"m": "g", "f": "b"}, alpha=0.5, ax=ax)
+    ax.set_title("Number of female and male users self-reporting each body type")
+    sns.despine(ax=ax)
+    return fig
+
+
+def compare_prevalence(df, attribute, g1name, g2name, g1n, g2n, g1color, g2color, ax):
+    """Draw the relative prevalence of each value of an attribute in two groups.
+
+    df is the output of prevalence.compare() for that attribute, and g1n, g2n the
+    sizes of the groups.
+    """
+    # Draw the left bars
+    ax.barh(y=range(len(df)), width=df["frac12"], left=0, height=1, align="center", color=g1color, alpha=1)
+    # Draw the right bars
+    ax.barh(y=range(len(df)), width=df["frac12"] - 1, left=1, height=1, align="center", color=g2color, alpha=1)
+
+    # Draw a faint vertical line for x=0.5
+    ax.axvline(x=0.5, color="k", alpha=0.1, linewidth=5)
+    ax.set(xlim=[0, 1],
+           ylim=[-1, len(df) - 0.5],
+           yticks=range(len(df)),
+           yticklabels=df.index,
+           xlabel="fraction of users",
+           ylabel=attribute)
+
+    ax.set_title("Relative prevalence of {} ($n={}$) vs {} ($n={}$)\nfor each value of {}".format(
+                 g1name, g1n, g2name, g2n, attribute),
+                 loc="left", fontdict={"fontsize": "medium"})
+    ax.text(0.02, len(df) - 1, g1name, verticalalignment="center", horizontalalignment="left", size="smaller",
+            color="w")
+    ax.text(0.98, 0, g2name, verticalalignment="center", horizontalalignment="right", size="smaller", color="w")
+
+    def color_for_frac(f):
+        # Blend g1color and g2color according to f (convex linear combination):
+        # 0 returns g1color, 1 returns g2color)
+        ret = np.array(g1color) * f + np.array(g2color) * (1 - f)
+        if np.linalg.norm(ret) > 1:              # If the resulting rgb color is too bright for text,
+            ret = (ret / np.linalg.norm(ret)) * 1  # rescale its brightness to dark (but keep hue)
+        return ret
+
+    for i, tl in enumerate(ax.get_yticklabels()):
+        tl.set_color(color_for_frac(df["frac12"].iloc[i]))
+
+    sns.despine(ax=ax, left=True)
+
+
+def body_type_prevalence(df, g1n, g2n):
+    """Relative prevalence of each body type in male vs female users."""
+    fig, ax = plt.subplots(figsize=(10, 3))
+    compare_prevalence(df, "body_type", "male users", "female users", g1n, g2n,
+                       g1color=[0.5, 0.5, 1.0], g2color=[1.0, 0.5, 0.5], ax=ax)
+    fig.tight_layout()
+    return fig
+
+
+def essay_heatmap(first, last, n_words):
+    """Which users use which words, from two dense (users x words) slices of the term matrix."""
+    fig, (ax1, ax2) = plt.subplots(nrows=2, sharex=True, figsize=(10, 15))
+    sns.heatmap(first.transpose(), ax=ax1, cbar=None)
+    sns.heatmap(last.transpose(), ax=ax2, cbar=None)
+    ax1.set_title("Which of the first 100 users (columns) use which of the 50 most frequent words (rows)")
+    ax2.set_title("Which of the first 100 users (columns) use which of the 50 least frequent words (rows) among the "
+                  + str(n_words) + " most frequent ones")
+    for ax in (ax1, ax2):
+        ax.set_xticks([])
+        ax.set_xlabel("Users")
+        ax.set_ylabel("User's essays contain word")
+    fig.tight_layout()
+    return fig
+
+
+def essay_raster(density, n_users, n_words, reordered=False):
+    """Which users use which words, for the whole term matrix, from its density in a grid of bins (text.bin_matrix).
+
+    The grid is drawn as one raster image, whatever the number of users and words.
+    """
+    fig, ax = plt.subplots(figsize=(10, 6))
+    image = ax.imshow(density.T, aspect="auto", interpolation="nearest", extent=(0, n_users, n_words, 0),
+                      cmap=sns.color_palette("rocket", as_cmap=True), norm=PowerNorm(gamma=0.5))
+    fig.colorbar(image, ax=ax, label="Fraction of users using the word")
+    if reordered:
+        ax.set_title("Which users (columns) use which words (rows), similar users and words next to each other")
+        ax.set_xlabel("Users")
+        ax.set_ylabel("Words")
+    else:
+        ax.set_title("Which users (columns) use which of the {} most frequent words (rows)".format(n_words))
+        ax.set_xlabel("Users")
+        ax.set_ylabel("Words, most frequent first")
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,161 @@
+"""CDC growth charts (stature for age) and their comparison with the heights reported by users."""
+
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+CDC_URL = "https://www.cdc.gov/growthcharts/data/zscore/statage.csv"
+
+PERCENTILES = [3, 5, 10, 25, 50, 75, 90, 95, 97]
+PERCENTILE_COLUMNS = ["P" + str(p) for p in PERCENTILES]  # names of percentile columns
+
+INCHES_PER_CM = 0.393701
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "okcupid")
+
+
+def prepare(cdc):
+    """Adjust the CDC table to our format: sex as "m"/"f", age in years, percentiles in inches."""
+    cdc = cdc.copy()
+    cdc["Sex"] = cdc["Sex"].replace({1: "m", 2: "f"})
+    cdc["Age"] = cdc["Agemos"] / 12  # convert age in months to age in fractional years
+    cdc[PERCENTILE_COLUMNS] = cdc[PERCENTILE_COLUMNS] * INCHES_PER_CM  # convert from centimeters to inches (ugh)
+    return cdc
+
+
+def by_year(cdc, sex):
+    """Mean percentiles of one sex for each age, rounded down to whole years."""
+    cdc = cdc[cdc["Sex"] == sex]
+    return cdc.groupby(np.floor(cdc["Age"]))[PERCENTILE_COLUMNS].mean()
+
+
+def jitter_quantiles(h, n_boot=1000, resample=True, rng=None, block=4_000_000):
+    """Percentiles of n_boot jittered replicates of the heights h, as an (n_boot, len(PERCENTILES)) array.
+
+    Each replicate adds uniform noise in [-0.5,+0.5] to every height (and, with
+    resample, first draws the heights with replacement). Replicates are drawn as 2-D
+    arrays of at most block values, so that all percentiles of a batch of
+    replicates come from one np.quantile call along the rows.
+    """
+    rng = np.random.default_rng(rng)
+    h = np.asarray(pd.Series(h).dropna(), dtype=float)
+    q = np.array(PERCENTILES) / 100
+    out = np.empty((n_boot, len(q)))
+    if len(h) == 0:
+        out.fill(np.nan)
+        return out
+    step = max(1, block // len(h))
+    for start in range(0, n_boot, step):
+        size = (min(step, n_boot - start), len(h))
+        x = h[rng.integers(0, len(h), size=size)] if resample else np.broadcast_to(h, size)
+        x = x + rng.uniform(low=-0.5, high=+0.5, size=size)
+        out[start:start + size[0]] = np.quantile(x, q, axis=1).T
+    return out
+
+
+def percentile_comparison(heights, cdc_age, rng=None, n_boot=1000, ci=0.95):
+    """Compare the percentiles of the users' heights with the CDC ones.
+
+    heights maps each sex to the heights of users of a given age, and cdc_age holds
+    the CDC rows of that age indexed by sex. Reported heights are integers, so they
+    are jittered by uniform noise in [-0.5,+0.5] (assuming users rounded their height
+    to the nearest inch) to smooth the percentiles. users is the average over n_boot
+    jitter draws, and users_low/users_high (gap_low/gap_high) the ci confidence
+    interval of a bootstrap of the users (resampled and jittered). Returns users,
+    CDC and gap columns indexed by sex and percentile.
+    """
+    rng = np.random.default_rng(rng)
+    tails = [(1 - ci) / 2, (1 + ci) / 2]
+    stats = []
+    for sex, h in heights.items():
+        users = jitter_quantiles(h, n_boot, resample=False, rng=rng).mean(axis=0)
+        low, high = np.quantile(jitter_quantiles(h, n_boot, rng=rng), tails, axis=0)
+        stats.append(pd.DataFrame({"sex": sex,
+                                   "percentile": PERCENTILES,
+                                   "CDC": cdc_age.loc[sex, PERCENTILE_COLUMNS].to_numpy(dtype=float),
+                                   "users": users,
+                                   "users_low": low,
+                                   "users_high": high}))
+    stats = pd.concat(stats).set_index(["sex", "percentile"]).sort_index()
+    # For each percentile, compute the gap between users and CDC
+    stats["gap"] = stats["users"] - stats["CDC"]
+    stats["gap_low"] = stats["users_low"] - stats["CDC"]
+    stats["gap_high"] = stats["users_high"] - stats["CDC"]
+    return stats
+
+
+def percentile_comparison_by_age(profiles, cdc, ages=None, rng=None, n_boot=1000, ci=0.95):
+    """percentile_comparison for every age of the users (or the given ages), indexed by sex, age and percentile.
+
+    profiles has sex, age and height columns; users older than 20 are compared with
+    the 20-year-old CDC percentiles (the last year of the charts).
+    """
+    rng = np.random.default_rng(rng)
+    cdc_years = pd.concat({sex: by_year(cdc, sex) for sex in "mf"}, names=["Sex"])
+    last = cdc_years.index.get_level_values(1).max()
+    heights = profiles.dropna(subset=["height"]).groupby(["age", "sex"], observed=True)["height"]
+    groups = {age: {} for age in (sorted(profiles["age"].dropna().unique()) if ages is None else ages)}
+    for (age, sex), h in heights:
+        if age in groups:
+            groups[age][sex] = h
+    stats = {}
+    for age, h in groups.items():
+        if h:
+            cdc_age = cdc_years.xs(min(np.floor(age), last), level=1)
+            stats[age] = percentile_comparison(h, cdc_age, rng=rng, n_boot=n_boot, ci=ci)
+    return pd.concat(stats, names=["age"]).reorder_levels(["sex", "age", "percentile"]).sort_index()
+
+
+class GrowthChart:
+    """The CDC stature-for-age table, loaded once into per-sex arrays for vectorized lookups.
+
+    The table gives, for each sex and age in months (24 to 240.5), the L, M and S
+    parameters of the LMS method (M is the median stature in centimeters), from
+    which the z-score of any height follows. Lookups between two tabulated ages
+    interpolate linearly; ages beyond 20 use the 20-year-old (adult) values.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.table = prepare(raw)
+        self._lms = {}
+        for sex, rows in raw.groupby("Sex"):
+            rows = rows.sort_values("Agemos")
+            self._lms[{1: "m", 2: "f"}.get(sex, sex)] = rows[["Agemos", "L", "M", "S"]].to_numpy(dtype=float).T
+
+    @classmethod
+    def load(cls, url=CDC_URL, cache_dir=CACHE_DIR):
+        """Read the table from the local copy in cache_dir, downloading it on first use."""
+        if os.path.exists(url):
+            return cls(pd.read_csv(url))
+        path = os.path.join(cache_dir, os.path.basename(url))
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            pd.read_csv(url).to_csv(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        return cls(pd.read_csv(path))
+
+    def lms(self, sex, age):
+        """L, M, S arrays for arrays of sexes ("m"/"f") and ages in years."""
+        sex = np.asarray(sex, dtype=object)
+        # Users report whole years: look up the middle of their year of age
+        months = np.asarray(age, dtype=float) * 12 + 6
+        out = np.full((3,) + months.shape, np.nan)
+        for s, (agemos, L, M, S) in self._lms.items():
+            mask = sex == s
+            for i, param in enumerate((L, M, S)):
+                out[i][mask] = np.interp(months[mask], agemos, param)
+        return out
+
+    def zscore(self, sex, age, height):
+        """CDC z-score of heights in inches, for arrays of sexes, ages in years and heights."""
+        L, M, S = self.lms(sex, age)
+        x = np.asarray(height, dtype=float) / INCHES_PER_CM / M
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(np.abs(L) > 1e-12, (x ** L - 1) / (L * S), np.log(x) / S)
+
+    def percentile(self, sex, age, height):
+        """CDC percentile (0-100) of heights in inches, for arrays of sexes, ages in years and heights."""
+        return norm.cdf(self.zscore(sex, age, height)) * 100
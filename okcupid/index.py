@@ -0,0 +1,173 @@
+"""Positional inverted index over the essays, for fast word, phrase and prefix probes."""
+
+import bisect
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from okcupid.cache import decode_strings, encode_strings
+from okcupid.text import EssayBuffer, split_tokens, tokenize
+
+# The words extracted by "[a-z]*"
+LOWERCASE_WORD = re.compile("[a-z]+")
+
+# Version of the layout of saved indexes, part of their key: indexes saved in an older layout are rebuilt
+FORMAT = 3
+
+
+class InvertedIndex:
+    """Map every term to its postings, the sorted positions where it occurs.
+
+    All essays are seen as one token stream: a position is a global token number,
+    and doc_offsets[u]:doc_offsets[u+1] are the positions of user u (users are row
+    positions in the essays). Postings of all terms are stored back to back
+    in one flat array; offsets[i]:offsets[i+1] is the slice of the i-th term of the
+    sorted term list. stream holds the term id of every position (forward index),
+    and joined tells whether the token of a position follows the previous one after
+    a single space (see text.split_tokens): phrases only match over joined tokens,
+    like the regexes "\\bisaac asimov\\b" they replace.
+    """
+
+    def __init__(self, terms, offsets, postings, stream, doc_offsets, joined):
+        self.terms = list(terms)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.postings_ = np.asarray(postings, dtype=np.int64)
+        self.stream = np.asarray(stream, dtype=np.int32)
+        self.doc_offsets = np.asarray(doc_offsets, dtype=np.int64)
+        self.joined = np.asarray(joined, dtype=bool)
+        self._ids = {t: i for i, t in enumerate(self.terms)}
+
+    @property
+    def n_users(self):
+        return len(self.doc_offsets) - 1
+
+    @classmethod
+    def build(cls, essays):
+        """Index an iterable of essays, or an EssayBuffer (tokenized in place)."""
+        vocab = {}
+        stream = []
+        joined = []
+        if isinstance(essays, EssayBuffer):
+            counts = np.zeros(len(essays), dtype=np.int64)
+            for tokens, users, block_joined in essays.tokens(joins=True):
+                stream.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+                joined.append(block_joined)
+                if len(users):  # users of a block are a narrow range: count them there, not over all users
+                    counts[users[0]:users[-1] + 1] += np.bincount(users - users[0])
+            doc_offsets = np.concatenate([[0], np.cumsum(counts)])
+        else:
+            doc_offsets = [0]
+            for e in essays:
+                tokens, essay_joined = split_tokens(e)
+                stream.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+                joined.append(np.array(essay_joined, dtype=bool))
+                doc_offsets.append(len(stream))
+        joined = np.concatenate(joined) if joined else np.zeros(0, dtype=bool)
+        # Renumber term ids so that they follow the alphabetical order of the terms
+        terms = np.array(sorted(vocab, key=vocab.get), dtype=object)
+        order = np.argsort(terms)
+        rank = np.empty(len(terms), dtype=np.int32)
+        rank[order] = np.arange(len(terms), dtype=np.int32)
+        stream = rank[np.asarray(stream, dtype=np.int64)]
+        # A stable sort keeps the positions of each term in increasing order
+        postings = np.argsort(stream, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(stream, minlength=len(terms)), out=offsets[1:])
+        return cls(terms[order].tolist(), offsets, postings, stream, doc_offsets, joined)
+
+    def save(self, path, key=None):
+        """Save the index, uncompressed (compressing the postings takes longer than building them).
+
+        Terms are stored as a UTF-8 buffer and offsets (see cache.encode_strings),
+        so loading never unpickles anything. key, if given, identifies the indexed
+        essays (see cached).
+        """
+        terms, term_offsets = encode_strings(self.terms)
+        extra = {} if key is None else {"key": np.array(key)}
+        np.savez(path, terms=terms, term_offsets=term_offsets, offsets=self.offsets,
+                 postings=self.postings_, stream=self.stream, doc_offsets=self.doc_offsets, joined=self.joined,
+                 **extra)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            return cls(decode_strings(f["terms"], f["term_offsets"]), f["offsets"], f["postings"], f["stream"],
+                       f["doc_offsets"], f["joined"])
+
+    @classmethod
+    def cached(cls, path, essays):
+        """The index of an EssayBuffer, loaded from path if it was saved for the same essays, else built and saved."""
+        key = "{}:{}".format(FORMAT, essays.digest())
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as f:
+                fresh = "key" in f and str(f["key"]) == key
+            if fresh:
+                return cls.load(path)
+        index = cls.build(essays)
+        index.save(path, key)
+        return index
+
+    def users_of(self, positions):
+        """User of each global position."""
+        return np.searchsorted(self.doc_offsets, positions, side="right") - 1
+
+    def postings(self, term):
+        """Sorted global positions of a term (empty if it never occurs)."""
+        i = self._ids.get(term)
+        if i is None:
+            return self.postings_[:0]
+        return self.postings_[self.offsets[i]:self.offsets[i + 1]]
+
+    def starts(self, phrase):
+        """Sorted global positions where the terms of the phrase occur consecutively, separated by single spaces.
+
+        The first token of every user is never joined, so no match runs from one user into the next.
+        """
+        terms = tokenize(phrase)
+        keys = self.postings(terms[0]) if terms else self.postings_[:0]
+        for k, t in enumerate(terms[1:], 1):
+            if len(keys) == 0:
+                break
+            keys = np.intersect1d(keys, self.postings(t) - k, assume_unique=True)
+            keys = keys[self.joined[keys + k]]
+        return keys
+
+    def word(self, term):
+        """Sorted array of the users whose essays contain the term."""
+        return np.unique(self.users_of(self.postings(term)))
+
+    def phrase(self, phrase):
+        """Sorted array of the users whose essays contain the phrase."""
+        return np.unique(self.users_of(self.starts(phrase)))
+
+    def count(self, query):
+        """Number of users matching a word or phrase query."""
+        return len(self.phrase(query))
+
+    def prefix(self, prefix):
+        """Terms starting with prefix, as a {term: number of users} dict."""
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = bisect.bisect_left(self.terms, prefix + "\U0010ffff")
+        return {t: len(self.word(t)) for t in self.terms[lo:hi]}
+
+    def following(self, phrase):
+        """Count users by the first term following the phrase in their essays.
+
+        This is the index counterpart of
+        essays.str.extract("(\\bphrase [a-z]*\\b)").dropna().value_counts(): the
+        phrase must be followed by a single space and a token (not by markup or a line
+        break), and the first such occurrence of each user counts. Where the regex
+        extracts an empty word (the next token has capitals or digits), the user is
+        not counted.
+        """
+        n = len(tokenize(phrase))
+        starts = self.starts(phrase)
+        nxt = starts + n
+        keep = nxt < len(self.stream)
+        keep[keep] = self.joined[nxt[keep]]
+        # Positions are sorted, so the first occurrence of each user is its first match
+        users, first = np.unique(self.users_of(starts[keep]), return_index=True)
+        ids = self.stream[nxt[keep][first]]
+        return Counter(t for t in (self.terms[i] for i in ids.tolist()) if LOWERCASE_WORD.fullmatch(t))
@@ -0,0 +1,91 @@
+"""Index bootstrap for the okcupid collection and an explain() based report of collection scans."""
+
+import pymongo
+
+from okcupid.text import ESSAY_COLUMNS
+
+# Indexes backing the filters and sorts used in the analysis, as (name, keys)
+INDEXES = [
+    ("sex", [("sex", pymongo.ASCENDING)]),
+    ("age", [("age", pymongo.ASCENDING)]),
+    ("sex_age", [("sex", pymongo.ASCENDING), ("age", pymongo.ASCENDING)]),
+    ("sex_age_height", [("sex", pymongo.ASCENDING), ("age", pymongo.ASCENDING), ("height", pymongo.ASCENDING)]),
+    ("education", [("education", pymongo.ASCENDING)]),
+    ("speaks", [("speaks", pymongo.ASCENDING)]),
+    ("essays_text", [(f, pymongo.TEXT) for f in ESSAY_COLUMNS]),
+]
+
+# Queries issued by the analysis, as (name, filter, sort)
+QUERIES = [
+    ("sort by sex", {}, [("sex", pymongo.ASCENDING)]),
+    ("males", {"sex": "m"}, None),
+    ("females", {"sex": "f"}, None),
+    ("age outliers", {"age": {"$gt": 80}}, None),
+    ("males by age", {"sex": "m", "age": 20}, None),
+    ("graduates", {"education": "graduated from college/university"}, None),
+    ("english speakers", {"speaks": "english (fluently)"}, None),
+    ("essay text search", {"$text": {"$search": "sports"}}, None),
+    ("essay5 keyword", {"speaks": "spanish", "essay5_tokens": "sports"}, None),
+]
+
+
+def _key_spec(keys):
+    # Directions are sometimes reported as floats (1.0)
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+def same_keys(info, keys):
+    """True if an index_information() entry indexes the fields of keys, in the same order and directions."""
+    key = _key_spec(info["key"])
+    if ("_fts", pymongo.TEXT) in key:
+        # The server stores a text index as _fts/_ftsx keys, with the indexed fields as its weights
+        text_fields = {field for field, direction in keys if direction == pymongo.TEXT}
+        other = [k for k in _key_spec(keys) if k[1] != pymongo.TEXT]
+        return set(info.get("weights", {})) == text_fields and [k for k in key if k[0] not in ("_fts", "_ftsx")] == other
+    return key == _key_spec(keys)
+
+
+def missing_indexes(collection, indexes=INDEXES):
+    """Names of the indexes of the spec that don't exist on the collection, or exist with other keys."""
+    existing = collection.index_information()
+    return [name for name, keys in indexes if name not in existing or not same_keys(existing[name], keys)]
+
+
+def ensure_indexes(collection, indexes=INDEXES):
+    """Create the missing indexes of the spec, and return their names.
+
+    An index with the name of one of the spec but other keys is dropped and created again.
+    """
+    missing = missing_indexes(collection, indexes)
+    existing = collection.index_information()
+    for name in missing:
+        if name in existing:
+            collection.drop_index(name)
+    models = [pymongo.IndexModel(keys, name=name) for name, keys in indexes if name in missing]
+    if models:
+        collection.create_indexes(models)
+    return missing
+
+
+def plan_stages(plan):
+    """All the stage names of a (winning) query plan tree."""
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return [s for s in stages if s]
+
+
+def explain_report(collection, queries=QUERIES):
+    """Explain each query and list the stages of its winning plan, flagging the ones doing a COLLSCAN."""
+    report = []
+    for name, query, sort in queries:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        planner = cursor.explain()["queryPlanner"]
+        stages = plan_stages(planner["winningPlan"])
+        report.append({"query": name, "stages": stages, "collscan": "COLLSCAN" in stages})
+    return report
@@ -0,0 +1,207 @@
+"""Bulk loading of CSV data (profiles.csv, the CDC growth charts) into MongoDB."""
+
+import datetime
+import hashlib
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from bson import ObjectId
+from pymongo import ReplaceOne
+
+from okcupid.text import ESSAY_COLUMNS, chunks
+
+
+def to_documents(frame):
+    """Convert a DataFrame chunk to a list of BSON-ready dicts (native Python values, NaN -> None)."""
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def iter_documents(source, chunksize=10000, transform=None):
+    """Yield the rows of a CSV path/URL (read in chunks) or of a DataFrame as documents.
+
+    transform, if given, is applied to each document (e.g. search.add_tokens).
+    """
+    if isinstance(source, pd.DataFrame):
+        frames = (source.iloc[start:start + chunksize] for start in range(0, len(source), chunksize))
+    else:
+        frames = pd.read_csv(source, chunksize=chunksize)
+    for frame in frames:
+        docs = to_documents(frame)
+        yield from docs if transform is None else map(transform, docs)
+
+
+def split_essays(doc):
+    """Move the essay fields (and their token arrays) of doc to a new document with the same _id; returns it."""
+    essays = {"_id": doc["_id"]}
+    for field in [f for f in doc if f.split("_")[0] in ESSAY_COLUMNS]:
+        essays[field] = doc.pop(field)
+    return essays
+
+
+def _insert(collection, batch, essays=None):
+    # With an essays collection, the essays of the batch are written there first, then the slim profiles, so
+    # a profile never exists without its essays. They are upserted: after a run interrupted between the two
+    # writes, the next sync inserts the profiles again and overwrites their essays instead of failing.
+    if essays is not None:
+        for doc in batch:
+            doc.setdefault("_id", ObjectId())
+        essays.bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in map(split_essays, batch)],
+                          ordered=False)
+    return len(collection.insert_many(batch, ordered=False).inserted_ids)
+
+
+def load(collection, source, batch_size=1000, chunksize=10000, workers=1, transform=None, verbose=True, essays=None):
+    """Insert every row of source into collection with unordered insert_many batches.
+
+    source is a CSV path or URL (read chunksize rows at a time, never as a whole) or
+    a DataFrame, and transform an optional per-document function. With workers > 1
+    the batches are sent from a pool of threads, keeping at most two batches per
+    thread in flight. With an essays collection, the essays are stored there
+    instead, under the _id of their profile (see okcupid.layout). Returns the
+    number of rows inserted, the elapsed seconds and the throughput.
+    """
+    def insert(batch):
+        return _insert(collection, batch, essays)
+
+    start = time.perf_counter()
+    rows = 0
+    batches = chunks(iter_documents(source, chunksize, transform), batch_size)
+    if workers == 1:
+        for batch in batches:
+            rows += insert(batch)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.submit(insert, batch))
+                if len(pending) >= 2 * workers:
+                    rows += pending.popleft().result()
+            while pending:
+                rows += pending.popleft().result()
+    seconds = time.perf_counter() - start
+    stats = {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else float("nan")}
+    if verbose:
+        print("Inserted {rows} rows into {name} in {seconds:.1f}s ({rows_per_sec:.0f} rows/s)".format(
+            name=collection.name, **stats))
+    return stats
+
+
+def _canonical(value):
+    # read_csv infers dtypes per chunk: an integer column is float in the chunks where it has a missing value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def row_hash(doc):
+    """Stable hash of the content of a document, used as its _id by sync().
+
+    Integral floats hash like integers and NaN like None, so a row hashes the same
+    whatever dtypes its CSV chunk was read with.
+    """
+    canonical = {k: _canonical(v) for k, v in doc.items()}
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def file_watermark(path):
+    """Size and SHA-256 of a local file (None for URLs and DataFrames)."""
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return {"size": os.path.getsize(path), "sha256": h.hexdigest()}
+
+
+def sync_config(transform=None, essays=None):
+    """The settings of a sync that change the stored documents: the transform and the essays collection."""
+    return {"transform": None if transform is None else "{}.{}".format(transform.__module__, transform.__qualname__),
+            "essays": None if essays is None else essays.full_name}
+
+
+def _holds(collection, essays, rows):
+    # A collection dropped, emptied or trimmed since the last sync no longer matches the recorded row count
+    return (collection.count_documents({}) == rows and
+            (essays is None or essays.count_documents({}) == rows))
+
+
+def sync(collection, source, batch_size=1000, chunksize=10000, transform=None, verbose=True, essays=None):
+    """Make collection hold exactly the rows of source, writing only what changed.
+
+    Every row gets the hash of its content as _id: rows whose hash is not in the
+    collection yet (new or changed rows) are inserted, documents whose hash is no
+    longer in the source (removed or changed rows) are deleted, the others are left
+    alone. The watermark of the source file, the settings (see sync_config) and the
+    number of rows are recorded in the _sync collection of the database: with the
+    same file and settings, and a collection still holding that many documents, sync
+    is a no-op. transform (e.g. search.add_tokens) is applied to inserted documents
+    only, after hashing, so a change of settings rewrites all the documents. With an
+    essays collection, the essays are kept there under the _id of their profile.
+    """
+    start = time.perf_counter()
+    name = source if isinstance(source, str) else "a DataFrame"
+    state = collection.database["_sync"]
+    watermark = file_watermark(source)
+    config = sync_config(transform, essays)
+    previous = state.find_one({"_id": collection.name})
+    stats = {"inserted": 0, "deleted": 0, "unchanged": 0}
+    if (watermark is not None and previous is not None and previous.get("watermark") == watermark
+            and previous.get("config") == config and _holds(collection, essays, previous.get("rows"))):
+        if verbose:
+            print("{} is up to date with {}".format(collection.name, name))
+        return stats
+
+    if previous is not None and previous.get("config") != config:
+        # Documents stored with other settings are not unchanged even where their hash is
+        collection.delete_many({})
+        if essays is not None:
+            essays.delete_many({})
+    existing = {doc["_id"] for doc in collection.find({}, {"_id": 1})}
+    if essays is not None:
+        # Profiles whose essays are missing (e.g. the essay collection was dropped) are written again
+        orphans = list(existing - {doc["_id"] for doc in essays.find({}, {"_id": 1})})
+        for i in range(0, len(orphans), batch_size):
+            collection.delete_many({"_id": {"$in": orphans[i:i + batch_size]}})
+        existing.difference_update(orphans)
+    seen = set()
+    batch = []
+    for doc in iter_documents(source, chunksize):
+        key = row_hash(doc)
+        n = 1
+        while key in seen:  # identical rows get distinct, but still stable, ids
+            key, n = row_hash({"_id": key, "n": n}), n + 1
+        seen.add(key)
+        if key in existing:
+            stats["unchanged"] += 1
+            continue
+        doc["_id"] = key
+        batch.append(doc if transform is None else transform(doc))
+        if len(batch) == batch_size:
+            stats["inserted"] += _insert(collection, batch, essays)
+            batch = []
+    if batch:
+        stats["inserted"] += _insert(collection, batch, essays)
+    removed = list(existing - seen)
+    for i in range(0, len(removed), batch_size):
+        stats["deleted"] += collection.delete_many({"_id": {"$in": removed[i:i + batch_size]}}).deleted_count
+        if essays is not None:
+            essays.delete_many({"_id": {"$in": removed[i:i + batch_size]}})
+
+    state.replace_one({"_id": collection.name},
+                      {"_id": collection.name, "source": name,
+                       "watermark": watermark, "config": config, "rows": len(seen),
+                       "synced_at": datetime.datetime.now(datetime.timezone.utc)},
+                      upsert=True)
+    if verbose:
+        print("Synced {} with {} in {:.1f}s: {inserted} inserted, {deleted} deleted, {unchanged} unchanged".format(
+            collection.name, name, time.perf_counter() - start, **stats))
+    return stats
@@ -0,0 +1,61 @@
+"""Hot/cold layout of the profiles: slim profile documents, and their essays in a separate compressed collection.
+
+The essays are most of the bytes of a profile document, but demographic queries
+(find, sort, $match on sex, age, ...) never read them. Storing them apart, in a
+collection keyed by the _id of the profile, keeps the working set of those
+queries small enough to stay in the cache:
+
+    essays = layout.essay_collection(db)
+    ingest.sync(db.profiles, PROFILES_CSV, transform=search.add_tokens, essays=essays)
+
+The essay collection uses zstd block compression (WiredTiger), which suits long
+text much better than the default snappy. Essays are fetched only when asked
+for, by _id (fetch_essays) or joined to a query with $lookup (with_essays).
+"""
+
+import pandas as pd
+
+from okcupid.text import ESSAY_COLUMNS
+
+
+def essay_collection(db, name="okcupid_essays", compressor="zstd"):
+    """The essay collection of db, created with the given WiredTiger block compressor if it doesn't exist."""
+    if name not in db.list_collection_names():
+        db.create_collection(name, storageEngine={"wiredTiger": {"configString": "block_compressor=" + compressor}})
+    return db[name]
+
+
+def with_essays(essays, match=None, fields=ESSAY_COLUMNS, stages=()):
+    """Aggregation pipeline over the profiles collection adding the essay fields of each profile.
+
+    essays is the essay collection (or its name); match filters the profiles
+    before the join, so only the essays of matching profiles are read, and stages
+    run between the $match and the $lookup (e.g. a $sort and a $limit).
+    """
+    name = essays if isinstance(essays, str) else essays.name
+    return ([{"$match": match or {}}] + list(stages) +
+            [{"$lookup": {"from": name, "localField": "_id", "foreignField": "_id", "as": "_essays"}},
+             {"$unwind": {"path": "$_essays", "preserveNullAndEmptyArrays": True}},
+             {"$addFields": {f: "$_essays." + f for f in fields}},
+             {"$project": {"_essays": 0}}])
+
+
+def fetch_essays(essays, ids, fields=ESSAY_COLUMNS, batch_size=10000):
+    """The essay fields of the profiles ids, as a DataFrame indexed by _id in the order of ids (NaN if missing)."""
+    ids = list(ids)
+    projection = dict.fromkeys(fields, 1)
+    docs = []
+    for i in range(0, len(ids), batch_size):
+        docs.extend(essays.find({"_id": {"$in": ids[i:i + batch_size]}}, projection))
+    frame = pd.DataFrame(docs, columns=["_id"] + list(fields)).set_index("_id")
+    return frame.reindex(ids)
+
+
+def storage_report(db, names):
+    """Document count, average document size, data size and storage (on disk) size of collections, in bytes."""
+    rows = {}
+    for name in names:
+        stats = db.command("collStats", name)
+        rows[name] = {"count": stats.get("count"), "avgObjSize": stats.get("avgObjSize"),
+                      "size": stats.get("size"), "storageSize": stats.get("storageSize")}
+    return pd.DataFrame.from_dict(rows, orient="index")
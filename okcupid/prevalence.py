@@ -0,0 +1,118 @@
+"""Relative prevalence of categorical values between groups of users (the compare_prevalence kernel).
+
+All attributes and all groups are counted at once, with a single sparse product
+between the one-hot encoding of the attribute values (users x values) and the
+group indicators (users x groups). Groups are boolean masks and may overlap.
+The same product with the user x word term matrix compares the essay vocabulary
+of groups (word_counts, contrast).
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+
+
+def indicators(groups, n):
+    """Sparse (users x groups) 0/1 matrix from a {name: boolean mask} dict."""
+    masks = [np.asarray(m, dtype=bool) for m in groups.values()]
+    rows = np.concatenate([np.flatnonzero(m) for m in masks]) if masks else np.zeros(0, dtype=np.int64)
+    cols = np.repeat(np.arange(len(masks)), [m.sum() for m in masks])
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(n, len(masks)))
+
+
+def one_hot(frame, columns):
+    """Sparse (users x values) one-hot encoding of the columns, and the (attribute, value) index of its columns."""
+    rows, cols, keys = [], [], []
+    for c in columns:
+        values = frame[c].astype("category")
+        codes = values.cat.codes.to_numpy()
+        valid = np.flatnonzero(codes >= 0)  # missing values are not counted, like value_counts()
+        rows.append(valid)
+        cols.append(codes[valid].astype(np.int64) + len(keys))
+        keys.extend((c, v) for v in values.cat.categories)
+    X = sparse.csr_matrix((np.ones(sum(map(len, rows)), dtype=np.int64), (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(len(frame), len(keys)))
+    return X, pd.MultiIndex.from_tuples(keys, names=["attribute", "value"])
+
+
+def crosstab(frame, columns, groups):
+    """Number of users of each group having each value of each attribute.
+
+    Returns a DataFrame indexed by (attribute, value) with one column per group.
+    """
+    X, keys = one_hot(frame, columns)
+    counts = (X.T @ indicators(groups, len(frame))).toarray()
+    return pd.DataFrame(counts, index=keys, columns=list(groups))
+
+
+def compare(counts, g1, g2, min_count=50):
+    """The g1n/g2n/g1f/g2f/frac12 table of two groups of a crosstab, for all its attributes.
+
+    g1f (g2f) is the fraction of g1 (g2) users with each value, among the users of
+    the group with a value for the attribute. frac12 is 0.5 for values equally
+    frequent in both groups, 0 (1) for values only seen in g2 (g1). Values seen
+    less than min_count times in the two groups are dropped.
+    """
+    df = pd.DataFrame({"g1n": counts[g1], "g2n": counts[g2]})
+    totals = df.groupby(level="attribute").transform("sum")
+    df["g1f"] = df["g1n"] / totals["g1n"]
+    df["g2f"] = df["g2n"] / totals["g2n"]
+    df["frac12"] = df["g1f"] / (df["g1f"] + df["g2f"])
+    df = df[(df["g1n"] + df["g2n"]) >= min_count]
+    return df.sort_values(["attribute", "frac12"])
+
+
+def screen(frame, columns, groups, pairs, min_count=50):
+    """compare() every attribute for several group pairs from one crosstab.
+
+    pairs is a list of (g1, g2) group names; the result has an extra first index
+    level naming the pair.
+    """
+    counts = crosstab(frame, columns, groups)
+    return pd.concat({"{} vs {}".format(g1, g2): compare(counts, g1, g2, min_count) for g1, g2 in pairs},
+                     names=["pair"])
+
+
+def word_counts(matrix, vocabulary, groups):
+    """Number of users of each group using each word, from the binary (users x words) term matrix.
+
+    Returns a DataFrame indexed by word with one column per group.
+    """
+    counts = (sparse.csr_matrix(matrix, dtype=np.int64).T @ indicators(groups, matrix.shape[0])).toarray()
+    return pd.DataFrame(counts, index=pd.Index(vocabulary, name="word"), columns=list(groups))
+
+
+def contrast(counts, sizes, g1, g2, min_count=50, prior=0.5):
+    """The g1n/g2n/g1f/g2f/frac12 table of two groups for every word of word_counts, with log-odds and significance.
+
+    sizes maps each group to its number of users: g1f (g2f) is the fraction of the
+    users of g1 (g2) using each word. log_odds is the log odds ratio of using the
+    word in g1 vs g2 (prior is added to the four cells of each 2x2 table), z its
+    Wald statistic and pvalue the two-sided p-value. Words used by less than
+    min_count users of the two groups are dropped.
+    """
+    n1, n2 = sizes[g1], sizes[g2]
+    df = pd.DataFrame({"g1n": counts[g1], "g2n": counts[g2]})
+    df["g1f"] = df["g1n"] / n1
+    df["g2f"] = df["g2n"] / n2
+    df["frac12"] = df["g1f"] / (df["g1f"] + df["g2f"])
+    a, b = df["g1n"] + prior, n1 - df["g1n"] + prior
+    c, d = df["g2n"] + prior, n2 - df["g2n"] + prior
+    df["log_odds"] = np.log(a / b) - np.log(c / d)
+    df["z"] = df["log_odds"] / np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+    df["pvalue"] = 2 * norm.sf(np.abs(df["z"]))
+    df = df[(df["g1n"] + df["g2n"]) >= min_count]
+    return df.sort_values("log_odds")
+
+
+def word_screen(matrix, vocabulary, groups, pairs, min_count=50):
+    """contrast() the whole vocabulary for several group pairs from one sparse product.
+
+    pairs is a list of (g1, g2) group names; the result has an extra first index
+    level naming the pair.
+    """
+    counts = word_counts(matrix, vocabulary, groups)
+    sizes = {name: int(np.asarray(mask, dtype=bool).sum()) for name, mask in groups.items()}
+    return pd.concat({"{} vs {}".format(g1, g2): contrast(counts, sizes, g1, g2, min_count) for g1, g2 in pairs},
+                     names=["pair"])
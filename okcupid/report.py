@@ -0,0 +1,140 @@
+"""Headless batch run of the analysis: compute the figure inputs, render the figures in parallel, write SVGs.
+
+    python -m okcupid.report --out Markdown_outputs
+    python -m okcupid.report --csv profiles.csv --processes 4
+
+Figures are named after the cells of the notebook that produce them
+(output_27_0.svg ... output_70_0.svg, as in Markdown_outputs/), and
+essay_raster.svg shows the whole user x word matrix.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pandas as pd  # noqa: E402
+
+from okcupid import cache, cube, dal, figures, growth, prevalence, snapshot, text, timing  # noqa: E402
+
+
+def load_profiles(csv=None, uri="mongodb://localhost:27017", database="test", snapshot_dir=None, listeners=()):
+    """Profiles (without essays) and the ten essay columns, from the CSV (or its snapshot) or from MongoDB."""
+    if csv is not None:
+        if snapshot_dir:
+            snap = snapshot.open_snapshot(csv, snapshot_dir)
+            profiles = snap.to_frame([c for c in dal.PROFILE_COLUMNS if c in snap.columns])
+            return dal.compact(profiles), snap.to_frame(text.ESSAY_COLUMNS)
+        frame = pd.read_csv(csv)
+        return dal.compact(frame[[c for c in dal.PROFILE_COLUMNS if c in frame]]), frame[text.ESSAY_COLUMNS]
+    from pymongo import MongoClient
+    store = dal.ProfileStore(MongoClient(uri, event_listeners=list(listeners))[database].okcupid)
+    return store.profiles(), store.essays()
+
+
+def essay_contains(essays, n_words=10000, cache_dir=None):
+    """The d_contains term matrix (as a sparse DataFrame) of the most common words."""
+    features = cache.essay_features(essays, cache.FeatureCache(cache_dir) if cache_dir else None, n_words=n_words)
+    return text.contains_frame(features.matrix, features.words)
+
+
+def prepare(profiles, essays, cdc, cache_dir=None):
+    """Compute the (small) inputs of every figure, as {name: (function, args)}."""
+    keep = profiles["age"] <= 80  # the two age outliers removed by the analysis
+    profiles, essays = profiles[keep], essays[keep.to_numpy()]
+    # One pass over the profiles; the summary figures are all drawn from roll-ups of the cube
+    summary = cube.Cube.build(profiles, ["sex", "age", "body_type"], {"height": range(36, 96)})
+    by_age = summary.rollup(["sex", "age"])
+    ages, g = by_age.count(), by_age.mean("height")
+    cdc20 = cdc[cdc["Age"] == 20].set_index("Sex")
+    heights20 = {sex: profiles.loc[(profiles["sex"] == sex) & (profiles["age"] == 20), "height"] for sex in "mf"}
+    groups = {"m": profiles["sex"] == "m", "f": profiles["sex"] == "f"}
+    body_types = prevalence.compare(prevalence.crosstab(profiles, ["body_type"], groups), "m", "f").loc["body_type"]
+    d_contains = essay_contains(essays, cache_dir=cache_dir)
+    matrix = d_contains.sparse.to_coo()
+    return {
+        "output_27_0": (figures.age_histograms, (ages,)),
+        "output_31_0": (figures.age_comparison, (ages,)),
+        "output_35_0": (figures.height_distribution, (summary.rollup(["sex"]).histogram("height"),)),
+        "output_51_0": (figures.percentile_comparison, (growth.percentile_comparison(heights20, cdc20),)),
+        "output_54_0": (figures.height_vs_age, (g,)),
+        "output_57_0": (figures.height_vs_cdc, (g, growth.by_year(cdc, "m"), growth.by_year(cdc, "f"))),
+        "output_59_0": (figures.body_type_counts, (summary.rollup(["sex", "body_type"]).count(),)),
+        "output_61_0": (figures.body_type_prevalence, (body_types, groups["m"].sum(), groups["f"].sum())),
+        "output_70_0": (figures.essay_heatmap, (d_contains.iloc[0:100, 0:49].sparse.to_dense(),
+                                                d_contains.iloc[0:100, -49:-1].sparse.to_dense(),
+                                                d_contains.shape[1])),
+        "essay_raster": (figures.essay_raster, (text.bin_matrix(matrix), *matrix.shape)),
+    }
+
+
+def _init_worker():
+    import seaborn as sns
+    sns.set(style="ticks")
+    sns.set_context(context="notebook", font_scale=1)
+
+
+def render(name, function, args, out, fmt="svg"):
+    """Draw one figure and save it as out/name.fmt; returns the path and the rendering time."""
+    import matplotlib.pyplot as plt
+    start = time.perf_counter()
+    fig = function(*args)
+    path = os.path.join(out, "{}.{}".format(name, fmt))
+    fig.savefig(path)
+    plt.close(fig)
+    return path, time.perf_counter() - start
+
+
+def render_all(jobs, out, processes=None, fmt="svg"):
+    """Render the figures on a process pool (in this process with processes=1)."""
+    os.makedirs(out, exist_ok=True)
+    if processes == 1:
+        _init_worker()
+        return [render(name, f, args, out, fmt) for name, (f, args) in jobs.items()]
+    with ProcessPoolExecutor(processes, initializer=_init_worker) as pool:
+        futures = [pool.submit(render, name, f, args, out, fmt) for name, (f, args) in jobs.items()]
+        return [f.result() for f in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", help="read the profiles from this CSV instead of MongoDB")
+    parser.add_argument("--snapshot", help="read the CSV through a memory-mapped snapshot in this directory")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017", help="MongoDB URI")
+    parser.add_argument("--database", default="test")
+    parser.add_argument("--cdc", default=growth.CDC_URL, help="path or URL of the CDC statage.csv")
+    parser.add_argument("--out", default="Markdown_outputs", help="output directory")
+    parser.add_argument("--cache", default=".okcupid_cache", help="essay features cache directory ('' to disable)")
+    parser.add_argument("--only", nargs="+", help="only render these figures (e.g. output_27_0)")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--format", default="svg")
+    parser.add_argument("--profile", help="write the stage timings to this JSON file (and a .folded file next to it)")
+    args = parser.parse_args(argv)
+
+    profiler = timing.Profiler()
+    start = time.perf_counter()
+    with profiler.stage("report"):
+        with profiler.stage("load") as record:
+            profiles, essays = load_profiles(args.csv, args.mongo, args.database, args.snapshot,
+                                             listeners=[] if args.csv else [profiler.mongo_listener()])
+            record["rows"] = len(profiles)
+        with profiler.stage("prepare", rows=len(profiles)):
+            jobs = prepare(profiles, essays, growth.GrowthChart.load(args.cdc).table, args.cache)
+        if args.only:
+            jobs = {name: jobs[name] for name in args.only}
+        print("Prepared {} figures in {:.1f}s".format(len(jobs), time.perf_counter() - start))
+        with profiler.stage("render", rows=len(jobs)):
+            for path, seconds in render_all(jobs, args.out, args.processes, args.format):
+                print("{} ({:.1f}s)".format(path, seconds))
+    print("Done in {:.1f}s".format(time.perf_counter() - start))
+    if args.profile:
+        profiler.save(args.profile)
+        profiler.save_folded(os.path.splitext(args.profile)[0] + ".folded")
+
+
+if __name__ == "__main__":
+    main()
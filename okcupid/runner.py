@@ -0,0 +1,100 @@
+"""Run batches of named aggregation pipelines concurrently, streaming the results as they complete.
+
+With a Motor collection (motor.motor_asyncio) the pipelines run on the asyncio
+driver; with a pymongo collection each one runs in a worker thread, sharing the
+client's connection pool (pymongo clients are thread-safe). In both cases at
+most `concurrency` pipelines are in flight, so a batch takes about as long as
+its slowest query instead of the sum of all of them.
+
+    results = runner.run_all(collection, {"sports": [...], "family": [...]}, concurrency=8, timeout=30)
+"""
+
+import asyncio
+import itertools
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from okcupid import search
+
+QueryResult = namedtuple("QueryResult", ["name", "documents", "seconds", "error"])
+
+
+def _is_motor(collection):
+    return type(collection).__module__.startswith("motor")
+
+
+async def _aggregate(collection, pipeline, timeout, executor):
+    # maxTimeMS makes the server abandon the query too, not only the client waiting for it
+    options = {"maxTimeMS": int(timeout * 1000)} if timeout else {}
+    if _is_motor(collection):
+        return await collection.aggregate(pipeline, **options).to_list(None)
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, lambda: list(collection.aggregate(pipeline, **options)))
+
+
+async def iter_pipelines(collection, pipelines, concurrency=8, timeout=None):
+    """Yield a QueryResult for every (name, pipeline) of the pipelines dict, in completion order.
+
+    A query failing or running longer than timeout seconds yields a result with
+    documents None and its exception as error; the other queries go on.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    # One thread per query in flight (unused with Motor)
+    executor = None if _is_motor(collection) else ThreadPoolExecutor(concurrency)
+
+    async def run(name, pipeline):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                documents = await asyncio.wait_for(_aggregate(collection, pipeline, timeout, executor), timeout)
+                return QueryResult(name, documents, time.perf_counter() - start, None)
+            except Exception as e:  # reported with the result, so one bad query doesn't stop the batch
+                return QueryResult(name, None, time.perf_counter() - start, e)
+
+    tasks = [asyncio.ensure_future(run(name, pipeline)) for name, pipeline in pipelines.items()]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)  # don't wait for the threads of queries that timed out
+
+
+async def gather_pipelines(collection, pipelines, concurrency=8, timeout=None, callback=None):
+    """{name: QueryResult} of all the pipelines; callback(result) is called as each one completes."""
+    results = {}
+    async for result in iter_pipelines(collection, pipelines, concurrency, timeout):
+        results[result.name] = result
+        if callback is not None:
+            callback(result)
+    return {name: results[name] for name in pipelines}
+
+
+def run_all(collection, pipelines, concurrency=8, timeout=None, callback=None):
+    """Blocking gather_pipelines, usable from scripts and from notebooks (whose event loop is already running)."""
+    coroutine = gather_pipelines(collection, pipelines, concurrency, timeout, callback)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # Inside a running loop (Jupyter): run the batch on a loop of its own in another thread
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(result=asyncio.run(coroutine)))
+    thread.start()
+    thread.join()
+    return results["result"]
+
+
+def grid(field, patterns, groups, stages=()):
+    """Pipelines matching every (pattern, group) pair: essays of field containing the pattern, among a group.
+
+    patterns maps names to keywords, phrases or regular expressions (see
+    search.essay_match) and groups maps names to $match conditions; stages are
+    appended to every pipeline (e.g. a $count or a $project).
+    """
+    return {(p, g): [{"$match": {**groups[g], **search.essay_match(field, patterns[p])}}] + list(stages)
+            for p, g in itertools.product(patterns, groups)}
@@ -0,0 +1,67 @@
+"""Keyword and phrase search over the essays that can use an index instead of an unanchored $regex.
+
+Each essay field can be stored with a companion "<field>_tokens" array holding the
+distinct lowercase words of the essay (see add_tokens). With a multikey index on
+it, a keyword query is an index lookup, and a phrase query is an index lookup on
+all of its words followed by a regex check on the few candidate documents.
+"""
+
+import re
+
+import pymongo
+
+from okcupid.text import ESSAY_COLUMNS, tokenize
+
+REGEX_CHARS = set(".^$*+?{}[]\\|()")
+
+
+def token_field(field):
+    return field + "_tokens"
+
+
+def essay_tokens(text):
+    """Sorted distinct lowercase words of an essay."""
+    return sorted({t.lower() for t in tokenize(text)})
+
+
+def add_tokens(doc, fields=ESSAY_COLUMNS):
+    """Add the token arrays of the essay fields to a document (usable as an ingest.load transform)."""
+    for f in fields:
+        if f in doc:
+            doc[token_field(f)] = essay_tokens(doc[f])
+    return doc
+
+
+def ensure_token_indexes(collection, fields=ESSAY_COLUMNS):
+    collection.create_indexes([pymongo.IndexModel([(token_field(f), pymongo.ASCENDING)], name=token_field(f))
+                               for f in fields])
+
+
+def is_regex(pattern):
+    """True for compiled patterns and strings using regex syntax; those can only be matched with $regex."""
+    return isinstance(pattern, re.Pattern) or any(c in REGEX_CHARS for c in pattern)
+
+
+def essay_match(field, pattern, mode="tokens"):
+    """Return the $match conditions selecting documents whose essay field contains pattern.
+
+    A keyword or phrase is matched case-insensitively as whole words. mode="tokens"
+    uses the token arrays (see add_tokens), mode="text" uses the collection's text
+    index (narrowing with $text, then checking the field itself, since the text index
+    covers all the essays). Real regular expressions, and mode="regex", fall back to
+    a $regex scan of the field. A pattern without any word raises ValueError.
+    """
+    if mode == "regex" or is_regex(pattern):
+        return {field: {"$regex": pattern if isinstance(pattern, re.Pattern) else re.compile(pattern, re.I)}}
+    words = tokenize(pattern.lower())
+    if not words:
+        raise ValueError("Search pattern has no words: {!r}".format(pattern))
+    phrase = re.compile(r"\b" + r"\W+".join(map(re.escape, words)) + r"\b", re.I)
+    if mode == "text":
+        return {"$text": {"$search": '"{}"'.format(" ".join(words))}, field: {"$regex": phrase}}
+    if mode != "tokens":
+        raise ValueError("Unknown search mode: {}".format(mode))
+    match = {token_field(field): words[0] if len(words) == 1 else {"$all": words}}
+    if len(words) > 1:
+        match[field] = {"$regex": phrase}
+    return match
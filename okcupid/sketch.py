@@ -0,0 +1,170 @@
+"""Streaming word statistics over the essays in bounded memory.
+
+Essays are consumed in fixed-size chunks (from an EssayBuffer, or streamed from
+the CSV with text.read_essays), so the whole token stream is never held in memory:
+
+- CountMin estimates the frequency of any key (unigram or bigram) in a fixed
+  depth x width table of counters;
+- TopK keeps the heavy hitters, the candidates with the largest estimates,
+  bounded to a few times k;
+- Cooccurrence accumulates the sparse word x word matrix of the number of users
+  whose essays contain both words, over a fixed vocabulary.
+"""
+
+import heapq
+from collections import Counter, namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from okcupid.text import EssayBuffer, chunks, tokenize
+
+
+def _hash(keys):
+    # pandas' hash of strings is stable across processes, so sketches can be saved and merged
+    return pd.util.hash_array(np.asarray(keys, dtype=object))
+
+
+class CountMin:
+    """Count-Min sketch of key frequencies.
+
+    Estimates never undercount; with probability 1 - exp(-depth) they overcount by
+    at most e / width times the total count.
+    """
+
+    def __init__(self, width=2 ** 20, depth=4, seed=0):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        rng = np.random.default_rng(seed)
+        # Odd multipliers and offsets of one multiply-shift hash function per row
+        self._a = rng.integers(1, 2 ** 63, size=depth, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=depth, dtype=np.uint64)
+
+    def _buckets(self, keys):
+        h = _hash(keys)
+        return [((h * a + b) >> np.uint64(32)) % np.uint64(self.width) for a, b in zip(self._a, self._b)]
+
+    def add(self, keys, counts=1):
+        """Add counts (a scalar or one per key) to the keys."""
+        if len(keys) == 0:
+            return
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), (len(keys),))
+        for row, buckets in zip(self.table, self._buckets(keys)):
+            np.add.at(row, buckets.astype(np.int64), counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, keys):
+        """Estimated counts of the keys, as an array."""
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.min([row[buckets.astype(np.int64)] for row, buckets in zip(self.table, self._buckets(keys))], axis=0)
+
+    def merge(self, other):
+        """Add the counts of another sketch built with the same width, depth and seed."""
+        if self.table.shape != other.table.shape or not np.array_equal(self._a, other._a):
+            raise ValueError("sketches have different parameters")
+        self.table += other.table
+        self.total += other.total
+
+
+class TopK:
+    """The k most frequent keys of a stream, from a CountMin sketch and a bounded set of candidates."""
+
+    def __init__(self, k=1000, width=2 ** 20, depth=4, seed=0):
+        self.k = k
+        self.sketch = CountMin(width, depth, seed)
+        self.candidates = {}
+
+    def update(self, keys):
+        """Count an iterable of keys."""
+        counts = Counter(keys)
+        if not counts:
+            return
+        keys = list(counts)
+        self.sketch.add(keys, np.fromiter(counts.values(), dtype=np.int64, count=len(keys)))
+        self.candidates.update(zip(keys, self.sketch.estimate(keys).tolist()))
+        if len(self.candidates) > 4 * self.k:
+            self.candidates = dict(heapq.nlargest(self.k, self.candidates.items(), key=lambda kv: kv[1]))
+
+    def most_common(self, n=None):
+        """[(key, estimated count)] of the n (default k) most frequent keys, most frequent first."""
+        keys = list(self.candidates)
+        estimates = self.sketch.estimate(keys).tolist()  # refresh the estimates of early candidates
+        return heapq.nlargest(min(n or self.k, self.k), zip(keys, estimates), key=lambda kv: kv[1])
+
+
+class Cooccurrence:
+    """Number of users whose essays contain both words, for every pair of words of a vocabulary.
+
+    The diagonal holds the number of users using each word (document frequency).
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = list(vocabulary)
+        self._ids = {w: i for i, w in enumerate(self.vocabulary)}
+        self.counts = sparse.csr_matrix((len(self.vocabulary), len(self.vocabulary)), dtype=np.int64)
+
+    def update(self, tokens, users):
+        """Count a chunk of tokens, users giving the (chunk-local or global) user of each token."""
+        users = np.asarray(users, dtype=np.int64)
+        ids = np.fromiter((self._ids.get(t, -1) for t in tokens), dtype=np.int64, count=len(tokens))
+        keep = ids >= 0
+        if len(users):
+            rows = users - users.min()
+            n = int(rows.max()) + 1
+            x = sparse.csr_matrix((np.ones(keep.sum(), dtype=np.int64), (rows[keep], ids[keep])),
+                                  shape=(n, len(self.vocabulary)))
+            x.data[:] = 1  # binary: duplicate (user, word) entries were summed
+            self.counts = self.counts + (x.T @ x).tocsr()
+
+    def with_term(self, term, n=20):
+        """The n words most often used together with term, as a Series of numbers of users."""
+        i = self._ids[term]
+        row = self.counts.getrow(i).toarray().ravel()
+        row[i] = 0
+        top = np.argsort(-row, kind="stable")[:n]
+        return pd.Series(row[top], index=[self.vocabulary[j] for j in top], name=term)
+
+    def frame(self):
+        """The co-occurrence counts as a sparse DataFrame indexed and labelled by the vocabulary."""
+        return pd.DataFrame.sparse.from_spmatrix(self.counts, index=self.vocabulary, columns=self.vocabulary)
+
+
+EssayStatistics = namedtuple("EssayStatistics", ["unigrams", "bigrams", "cooccurrence"])
+
+
+def _token_chunks(essays, chunksize):
+    # (tokens, users) of chunks of essays; bigrams never cross two users
+    if isinstance(essays, EssayBuffer):
+        yield from essays.tokens(chunksize)
+        return
+    start = 0
+    for chunk in chunks(essays, chunksize):
+        tokens, users = [], []
+        for u, e in enumerate(chunk, start):
+            t = tokenize(e)
+            tokens.extend(t)
+            users.extend([u] * len(t))
+        start += len(chunk)
+        yield tokens, np.asarray(users, dtype=np.int64)
+
+
+def stream_statistics(essays, vocabulary=None, k=1000, chunksize=2000, width=2 ** 20, depth=4):
+    """Heavy hitter unigrams and bigrams, and word co-occurrences, in one streaming pass.
+
+    essays is an EssayBuffer or any iterable of essays (e.g. text.read_essays(path)).
+    Memory is bounded by the sketches (2 x depth x width counters), the candidates
+    (a few times k) and the co-occurrence matrix of vocabulary (skipped if None).
+    """
+    unigrams, bigrams = TopK(k, width, depth), TopK(k, width, depth, seed=1)
+    cooccurrence = Cooccurrence(vocabulary) if vocabulary is not None else None
+    for tokens, users in _token_chunks(essays, chunksize):
+        unigrams.update(tokens)
+        same = (users[1:] == users[:-1]).tolist()
+        bigrams.update(a + " " + b for a, b, s in zip(tokens, tokens[1:], same) if s)
+        if cooccurrence is not None:
+            cooccurrence.update(tokens, users)
+    return EssayStatistics(unigrams, bigrams, cooccurrence)
@@ -0,0 +1,116 @@
+"""Memory-mapped columnar snapshot of profiles.csv.
+
+The CSV is converted once into a directory holding one .npy file per column:
+
+- numeric columns are stored as they are (<name>.npy);
+- low cardinality text columns as integer codes (<name>.codes.npy), with their
+  categories in meta.json;
+- free text columns (the essays) as a string heap: the UTF-8 bytes of all values
+  back to back (<name>.heap.npy), their byte offsets (<name>.offsets.npy) and a
+  validity mask (<name>.valid.npy).
+
+Columns are opened lazily with np.load(mmap_mode="r"): loading is zero-copy, only
+the pages actually read are brought in, and processes opening the same snapshot
+share them through the page cache.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from okcupid.text import ESSAY_COLUMNS
+
+META = "meta.json"
+
+
+def _codes_dtype(n):
+    return np.int8 if n < 2 ** 7 else np.int16 if n < 2 ** 15 else np.int32
+
+
+def convert(csv, directory, max_category_ratio=0.5):
+    """Convert a CSV into a snapshot directory.
+
+    Text columns with fewer distinct values than max_category_ratio times the
+    number of rows become categoricals, the others (and the essays) string heaps.
+    """
+    frame = pd.read_csv(csv)
+    os.makedirs(directory, exist_ok=True)
+    columns = {}
+    for name in frame.columns:
+        values = frame[name]
+        path = os.path.join(directory, name)
+        if pd.api.types.is_numeric_dtype(values):
+            np.save(path + ".npy", values.to_numpy())
+            columns[name] = {"kind": "numeric"}
+        elif name not in ESSAY_COLUMNS and values.nunique() < max_category_ratio * len(values):
+            cat = values.astype("category").cat
+            np.save(path + ".codes.npy", cat.codes.to_numpy().astype(_codes_dtype(len(cat.categories))))
+            columns[name] = {"kind": "category", "categories": cat.categories.astype(str).tolist()}
+        else:
+            valid = values.notna().to_numpy()
+            encoded = [v.encode("utf-8") if ok else b"" for v, ok in zip(values.astype(object), valid)]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+            np.save(path + ".heap.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            np.save(path + ".offsets.npy", offsets)
+            np.save(path + ".valid.npy", valid)
+            columns[name] = {"kind": "string"}
+    # meta.json is written last: a snapshot without it is incomplete
+    with open(os.path.join(directory, META), "w") as f:
+        json.dump({"source": os.path.abspath(csv) if os.path.exists(csv) else csv,
+                   "rows": len(frame), "columns": columns}, f)
+    return Snapshot(directory)
+
+
+class Snapshot:
+    """Lazy, read-only access to the columns of a snapshot directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META)) as f:
+            self.meta = json.load(f)
+        self._cache = {}
+
+    @property
+    def columns(self):
+        return list(self.meta["columns"])
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def _array(self, name, suffix):
+        key = name + suffix
+        if key not in self._cache:
+            self._cache[key] = np.load(os.path.join(self.directory, key), mmap_mode="r")
+        return self._cache[key]
+
+    def strings(self, name):
+        """The raw (heap, offsets, valid) arrays of a string column, memory-mapped."""
+        return self._array(name, ".heap.npy"), self._array(name, ".offsets.npy"), self._array(name, ".valid.npy")
+
+    def __getitem__(self, name):
+        """One column as a Series; numeric and categorical columns are views of the mapped files."""
+        info = self.meta["columns"][name]
+        if info["kind"] == "numeric":
+            return pd.Series(self._array(name, ".npy"), name=name, copy=False)
+        if info["kind"] == "category":
+            codes = self._array(name, ".codes.npy")
+            return pd.Series(pd.Categorical.from_codes(codes, info["categories"]), name=name)
+        heap, offsets, valid = self.strings(name)
+        buffer = memoryview(heap)
+        values = [bytes(buffer[a:b]).decode("utf-8") if ok else None
+                  for a, b, ok in zip(offsets[:-1].tolist(), offsets[1:].tolist(), valid.tolist())]
+        return pd.Series(values, name=name, dtype=object)
+
+    def to_frame(self, columns=None):
+        return pd.DataFrame({c: self[c] for c in (self.columns if columns is None else columns)})
+
+
+def open_snapshot(csv, directory):
+    """Open the snapshot of csv, converting it first if it is missing or older than the CSV."""
+    meta = os.path.join(directory, META)
+    if not os.path.exists(meta) or (os.path.exists(csv) and os.path.getmtime(csv) > os.path.getmtime(meta)):
+        return convert(csv, directory)
+    return Snapshot(directory)
@@ -0,0 +1,303 @@
+"""Essay text processing: concatenation, word counts, tokenization and the user x word term matrix."""
+
+import hashlib
+import os
+import re
+import string
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# A maximal run of word characters. An alphabetic word w occurs in a text as a
+# token iff the regex "\bw\b" matches it, so the term matrix below gives exactly
+# the same answers as one str.contains("\\b"+w+"\\b") scan per word.
+TOKEN_RE = re.compile(r"\w+")
+TOKEN_SPLIT_RE = re.compile(r"(\w+)")
+
+# Characters stripped from both ends of whitespace separated words when counting them
+STRIP_CHARS = string.whitespace + string.punctuation
+
+ESSAY_COLUMNS = ["essay" + str(i) for i in range(10)]
+
+
+def tokenize(text):
+    """Return the list of word tokens of a single essay."""
+    return TOKEN_RE.findall(text) if isinstance(text, str) else []
+
+
+def split_tokens(text):
+    """The word tokens of a single essay, and for each one whether it follows the previous token after one space.
+
+    A phrase occurs in the text only over joined tokens: like the regex
+    "\\bisaac asimov\\b", "isaac asimov" doesn't match across punctuation, markup
+    (<br />) or line breaks. The first token is never joined.
+    """
+    if not isinstance(text, str):
+        return [], []
+    parts = TOKEN_SPLIT_RE.split(text)  # separator, token, separator, ..., token, separator
+    joined = [sep == " " for sep in parts[0:-1:2]]
+    if joined:
+        joined[0] = False
+    return parts[1::2], joined
+
+
+class EssayBuffer:
+    """The concatenated essays of all users, stored as one contiguous UTF-8 buffer and an offsets array.
+
+    Like an Arrow string array, essay i is data[offsets[i]:offsets[i+1]] (byte
+    offsets), and no per-user string object exists until one is asked for. Bytes
+    keep the buffer at one byte per ASCII character: a str of all the essays would
+    take 2 or 4 bytes per character as soon as one essay holds an emoji or a curly
+    quote. Every essay starts with a space, so no token ever spans two users.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, frame, columns=ESSAY_COLUMNS):
+        """Join the essay columns of each row (" " + essay0 + " " + essay1 ...) in one pass.
+
+        Missing essays count as empty strings; the columns of frame are left untouched.
+        """
+        values = [frame[c].to_numpy(dtype=object) for c in columns]
+        pieces = []
+        lengths = np.empty(len(frame), dtype=np.int64)
+        for i, row in enumerate(zip(*values)):
+            n = 0
+            for e in row:
+                pieces.append(b" ")
+                if isinstance(e, str):
+                    pieces.append(e.encode("utf-8"))
+                    n += len(pieces[-1])
+            lengths[i] = n + len(row)
+        offsets = np.zeros(len(frame) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(b"".join(pieces), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def __iter__(self):
+        offsets = self.offsets.tolist()
+        return (self.data[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:]))
+
+    def to_series(self, index=None):
+        return pd.Series(list(self), index=index, name="essays", dtype=object)
+
+    def tokens(self, block=2000, joins=False):
+        """Yield (tokens, users) of blocks of users; each essay is decoded on its own, only while it is tokenized.
+
+        With joins=True, yield (tokens, users, joined), joined being the boolean
+        array of split_tokens for every token.
+        """
+        offsets = self.offsets.tolist()
+        for start in range(0, len(self), block):
+            stop = min(start + block, len(self))
+            tokens, joined, counts = [], [], np.empty(stop - start, dtype=np.int64)
+            for i in range(start, stop):
+                essay = self.data[offsets[i]:offsets[i + 1]].decode("utf-8")
+                if joins:
+                    found, found_joined = split_tokens(essay)
+                    joined.extend(found_joined)
+                else:
+                    found = TOKEN_RE.findall(essay)
+                tokens.extend(found)
+                counts[i - start] = len(found)
+            users = np.repeat(np.arange(start, stop, dtype=np.int64), counts)
+            yield (tokens, users, np.array(joined, dtype=bool)) if joins else (tokens, users)
+
+    def digest(self):
+        """SHA-256 of the buffer and its offsets, to key results computed from these essays."""
+        h = hashlib.sha256(self.data)
+        h.update(self.offsets.tobytes())
+        return h.hexdigest()
+
+    def save(self, path):
+        np.savez(path, data=np.frombuffer(self.data, dtype=np.uint8), offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f["data"].tobytes(), f["offsets"])
+
+
+def _buffer_term_matrix(essays, index, binary, dtype):
+    # Blocks cover increasing, disjoint ranges of users, so the distinct (user, word) pairs of each block,
+    # in sorted order, are the next rows of the CSR matrix: no array of all the corpus' tokens is ever built
+    n_words = len(index)
+    row_counts = np.zeros(len(essays), dtype=np.int64)
+    indices, data = [], []
+    for tokens, users in essays.tokens():
+        ids = np.fromiter((index.get(t, -1) for t in tokens), dtype=np.int64, count=len(tokens))
+        keep = ids >= 0
+        pairs, counts = np.unique(users[keep] * n_words + ids[keep], return_counts=True)
+        rows = pairs // n_words
+        if len(rows):  # rows of a block are a narrow range: count them there, not over all users
+            row_counts[rows[0]:rows[-1] + 1] += np.bincount(rows - rows[0])
+        indices.append((pairs % n_words).astype(np.int32))
+        if not binary:
+            data.append(counts.astype(dtype or np.int32))
+    indptr = np.zeros(len(essays) + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=indptr[1:])
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    if binary:
+        data = np.ones(len(indices), dtype=dtype or bool)
+    else:
+        data = np.concatenate(data) if data else np.zeros(0, dtype=dtype or np.int32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(essays), n_words))
+
+
+def term_matrix(essays, vocabulary, binary=True, dtype=None):
+    """Build a sparse CSR (user x word) matrix in a single pass over the essays.
+
+    Each essay is tokenized once; tokens outside the vocabulary are ignored.
+    With binary=True the entry is True if the user's essay contains the word,
+    otherwise it is the number of occurrences. essays is an iterable of strings
+    or an EssayBuffer.
+    """
+    index = {w: i for i, w in enumerate(vocabulary)}
+    if isinstance(essays, EssayBuffer):
+        return _buffer_term_matrix(essays, index, binary, dtype)
+    indptr = [0]
+    indices = []
+    data = []
+    for e in essays:
+        ids = [index[t] for t in tokenize(e) if t in index]
+        if binary:
+            ids = sorted(set(ids))
+            indices.extend(ids)
+        else:
+            ids, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+            indices.extend(ids.tolist())
+            data.extend(counts.tolist())
+        indptr.append(len(indices))
+    shape = (len(indptr) - 1, len(index))
+    if binary:
+        data = np.ones(len(indices), dtype=dtype or bool)
+    else:
+        data = np.asarray(data, dtype=dtype or np.int32)
+    return sparse.csr_matrix((data, np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+                             shape=shape)
+
+
+def contains_frame(matrix, vocabulary, index=None):
+    """Wrap a term matrix in a sparse DataFrame with one column per word (the old d_contains layout)."""
+    return pd.DataFrame.sparse.from_spmatrix(matrix, index=index, columns=list(vocabulary))
+
+
+def chunks(iterable, size):
+    """Yield lists of at most size consecutive items of iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def concat_essays(frame):
+    """Concatenate the essay columns of each row into a single string (missing essays count as empty)."""
+    return EssayBuffer.from_frame(frame).to_series(frame.index)
+
+
+def read_essays(path, chunksize=5000):
+    """Stream the concatenated essays of each profile straight from profiles.csv."""
+    for chunk in pd.read_csv(path, usecols=ESSAY_COLUMNS, chunksize=chunksize):
+        yield from concat_essays(chunk).tolist()
+
+
+def _count_chunk(essays):
+    counts = Counter()
+    for e in essays:
+        if isinstance(e, str):
+            counts.update(w.strip(STRIP_CHARS) for w in e.split())
+    return counts
+
+
+def count_words(essays, processes=None, chunksize=2000):
+    """Count whitespace separated words (stripped of punctuation) over an iterable of essays.
+
+    The essays are consumed in chunks of chunksize, counted on a process pool and the
+    partial Counters merged as they complete. At most two chunks per process are in
+    flight, so memory stays flat even when essays is a stream (see read_essays).
+    With processes=1 everything runs in the current process.
+    """
+    processes = processes or os.cpu_count() or 1
+    wordcounts = Counter()
+    if processes == 1:
+        for chunk in chunks(essays, chunksize):
+            wordcounts.update(_count_chunk(chunk))
+        return wordcounts
+    with ProcessPoolExecutor(processes) as pool:
+        pending = deque()
+        for chunk in chunks(essays, chunksize):
+            pending.append(pool.submit(_count_chunk, chunk))
+            if len(pending) >= 2 * processes:
+                wordcounts.update(pending.popleft().result())
+        while pending:
+            wordcounts.update(pending.popleft().result())
+    return wordcounts
+
+
+def seriation(matrix):
+    """Row and column orders of a sparse matrix placing rows (columns) with similar patterns next to each other.
+
+    The orders sort the rows and the columns by their coordinate on the first
+    non-trivial axis of a correspondence analysis (the second singular vectors of
+    the matrix scaled by its row and column totals); empty rows and columns go last.
+    """
+    from scipy.sparse.linalg import svds
+    x = sparse.csr_matrix(matrix, dtype=np.float64)
+    rows, cols = np.asarray(x.sum(axis=1)).ravel(), np.asarray(x.sum(axis=0)).ravel()
+    with np.errstate(divide="ignore"):
+        r, c = np.where(rows > 0, 1 / np.sqrt(rows), 0), np.where(cols > 0, 1 / np.sqrt(cols), 0)
+    # Singular values come in increasing order; a loose tolerance is plenty for an ordering
+    u, s, vt = svds(sparse.diags(r) @ x @ sparse.diags(c), k=2, tol=1e-3)
+    row_score = np.where(rows > 0, u[:, 0] * r, np.inf)
+    col_score = np.where(cols > 0, vt[0] * c, np.inf)
+    return np.argsort(row_score, kind="stable"), np.argsort(col_score, kind="stable")
+
+
+def bin_matrix(matrix, shape=(500, 1000), row_order=None, col_order=None):
+    """Density of the nonzero entries of a sparse matrix in a grid of shape (row bins, column bins).
+
+    Consecutive rows (columns), in the given orders, are grouped into shape[0]
+    (shape[1]) bins of equal size; each bin holds the fraction of its entries that
+    are nonzero. The matrix is never densified.
+    """
+    coo = sparse.coo_matrix(matrix)
+    n, m = coo.shape
+    h, w = min(shape[0], n), min(shape[1], m)
+    row_pos = np.arange(n) if row_order is None else np.argsort(row_order)  # position of each row in the order
+    col_pos = np.arange(m) if col_order is None else np.argsort(col_order)
+    row_bin = np.arange(n, dtype=np.int64) * h // n  # bin of each position
+    col_bin = np.arange(m, dtype=np.int64) * w // m
+    nonzero = coo.data != 0
+    cells = row_bin[row_pos[coo.row[nonzero]]] * w + col_bin[col_pos[coo.col[nonzero]]]
+    counts = np.bincount(cells, minlength=h * w).reshape(h, w)
+    return counts / np.outer(np.bincount(row_bin, minlength=h), np.bincount(col_bin, minlength=w))
+
+
+EssayFeatures = namedtuple("EssayFeatures", ["essays", "wordcounts", "words", "matrix"])
+
+
+def essay_features(frame, n_words=10000, min_length=4, drop=("href",)):
+    """Run the whole essay pipeline on the essay columns of frame.
+
+    Returns the concatenated essays (an EssayBuffer), the word counts, the vocabulary
+    (the n_words most common words with at least min_length letters, except the
+    dropped ones) and the binary user x word term matrix.
+    """
+    essays = EssayBuffer.from_frame(frame)
+    wordcounts = count_words(essays)
+    words = [w for w, c in wordcounts.most_common(n_words) if len(w) >= min_length and w.isalpha() and w not in drop]
+    return EssayFeatures(essays, wordcounts, words, term_matrix(essays, words))
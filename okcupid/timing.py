@@ -0,0 +1,168 @@
+"""Stage timings of an analysis run: wall and CPU time, peak RSS, rows processed and MongoDB commands.
+
+    profiler = timing.Profiler()
+    client = MongoClient(event_listeners=[profiler.mongo_listener()])
+    with profiler.stage("load", rows=len(frame)):
+        ...
+    profiler.save("timings.json")               # one record per stage, and the Mongo command summary
+    profiler.save_folded("timings.folded")      # for flamegraph.pl / speedscope
+
+Stages nest: a stage opened inside another is recorded under its path
+("load;read_csv"). MongoDB commands are timed through pymongo command monitoring
+and charged to the innermost open stage, whatever thread runs them (pymongo calls
+listeners on the thread of the command, e.g. a worker of okcupid.runner), so the
+stack of open stages is shared by all threads: stages are meant to be opened by
+the main flow of the analysis, one at a time. Peak memory is measured for this
+process and, separately, for its child processes (e.g. the process pool of
+text.count_words), once they have exited.
+"""
+
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss(who="self"):
+    """Peak resident set size so far, in bytes (None where unavailable).
+
+    who="self" is this process; who="children" is the largest peak of its child
+    processes that have exited and been waited for.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if who == "children" else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, kilobytes elsewhere
+
+
+class Profiler:
+    """Collects the records of the stages of a run."""
+
+    def __init__(self):
+        self.records = []
+        self.commands = defaultdict(lambda: {"count": 0, "seconds": 0.0, "failed": 0})
+        self.started = time.time()
+        self._stack = []  # open stages, innermost last, shared by all threads
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """Time the enclosed block. Yields the stage record: set record["rows"] inside the block if unknown before."""
+        with self._lock:
+            parent = self._stack[-1] if self._stack else None
+        record = {"name": name,
+                  "path": parent["path"] + ";" + name if parent else name,
+                  "start": time.time() - self.started,
+                  "rows": rows,
+                  "mongo_commands": 0,
+                  "mongo_seconds": 0.0}
+        rss_before = peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        with self._lock:
+            self._stack.append(record)
+        try:
+            yield record
+        finally:
+            with self._lock:
+                self._stack.remove(record)
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["peak_rss"] = peak_rss()
+            record["peak_rss_children"] = peak_rss("children")
+            # The peak only grows: growth during the stage means the stage set a new peak
+            record["peak_rss_growth"] = record["peak_rss"] - rss_before if rss_before is not None else None
+            if record["rows"] and record["wall_seconds"] > 0:
+                record["rows_per_sec"] = record["rows"] / record["wall_seconds"]
+            self.records.append(record)
+
+    def timed(self, name=None, rows=None):
+        """Decorator timing every call of a function as a stage; rows(result) gives the rows processed."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__qualname__) as record:
+                    result = function(*args, **kwargs)
+                    if rows is not None:
+                        record["rows"] = rows(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def _command(self, event, failed=False):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            summary = self.commands[event.command_name]
+            summary["count"] += 1
+            summary["seconds"] += seconds
+            summary["failed"] += failed
+            if self._stack:
+                self._stack[-1]["mongo_commands"] += 1
+                self._stack[-1]["mongo_seconds"] += seconds
+
+    def mongo_listener(self):
+        """A pymongo CommandListener charging the duration of every command to the current stage.
+
+        Pass it to MongoClient(event_listeners=[...]), or register it globally with
+        pymongo.monitoring.register before creating the client.
+        """
+        from pymongo import monitoring
+
+        profiler = self
+
+        class Listener(monitoring.CommandListener):
+            def started(self, event):
+                pass
+
+            def succeeded(self, event):
+                profiler._command(event)
+
+            def failed(self, event):
+                profiler._command(event, failed=True)
+
+        return Listener()
+
+    def report(self):
+        """The run as a JSON-serializable dict: environment, stages (in completion order) and Mongo commands."""
+        return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "peak_rss": peak_rss(),
+                "peak_rss_children": peak_rss("children"),
+                "stages": self.records,
+                "mongo_commands": dict(self.commands)}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+
+    def folded(self):
+        """Folded stacks ("outer;inner microseconds" lines) of the self wall time of every stage path."""
+        total = defaultdict(float)
+        children = defaultdict(float)
+        for r in self.records:
+            total[r["path"]] += r["wall_seconds"]
+            if ";" in r["path"]:
+                children[r["path"].rsplit(";", 1)[0]] += r["wall_seconds"]
+        return ["{} {}".format(path, max(0, round((seconds - children[path]) * 1e6)))
+                for path, seconds in total.items()]
+
+    def save_folded(self, path):
+        with open(path, "w") as f:
+            f.write("\n".join(self.folded()) + "\n")
+
+    def summary(self):
+        """The stages as a DataFrame (one row per stage, in completion order)."""
+        return pd.DataFrame(self.records).set_index("path")